@@ -10,11 +10,14 @@ class Operation(Enum):
 
 
 class Die():
-    def __init__(self):
+    __slots__ = ('rng', 'result_history')
+
+    def __init__(self, rng=random):
+        self.rng = rng
         self.result_history = []
 
     def roll(self):
-        self.result_history.append(random.randint(1, 6))
+        self.result_history.append(self.rng.randint(1, 6))
 
     def value(self):
         return len([_ for _ in self.result_history if _ >= 4])
@@ -47,8 +50,13 @@ class Die():
 
 
 class DicePool():
-    def __init__(self, num_dice=0):
-        self.dice = [Die() for _ in range(num_dice)]
+    __slots__ = ('seed', '_rng', 'dice', 'result_history', 'change_history', 'action_history', 'value_history', 'has_exploded')
+
+    def __init__(self, num_dice=0, seed=None):
+        # Each pool has its own seeded generator, so a logged roll can be replayed from its seed.
+        self.seed = seed if seed is not None else random.getrandbits(63)
+        self._rng = None
+        self.dice = [Die(self.rng) for _ in range(num_dice)]
         self.result_history = []
         self.change_history = []
         self.action_history = []
@@ -59,12 +67,20 @@ class DicePool():
         self.has_exploded = False
 
 
+    @property
+    def rng(self):
+        # Made on first use. A generator's state is a few KB, and a roll builder's pool sits empty until the end.
+        if self._rng is None:
+            self._rng = random.Random(self.seed)
+        return self._rng
+
+
     def size(self):
         return len(self.dice)
 
 
     def add_dice(self, n):
-        self.dice += [Die() for _ in range(n)]
+        self.dice += [Die(self.rng) for _ in range(n)]
 
 
     def add_die(self):
@@ -166,3 +182,29 @@ class DicePool():
                     self.change_history[i]
                 ) for i in range(len(self.action_history))]
 
+
+
+def pack_history(pool):
+    '''Packs a pool's history into a compact blob for the roll log. Each step is one byte for the
+    operation, one for the number of dice, then the faces two to a byte.'''
+    packed = bytearray()
+    for operation, result, _, _, _ in pool.get_history():
+        packed += bytes([operation.value, len(result)])
+        padded = result + [0] if len(result) % 2 else result
+        packed += bytes([(padded[i] << 4) | padded[i + 1] for i in range(0, len(padded), 2)])
+    return bytes(packed)
+
+
+def unpack_history(packed):
+    '''The inverse of pack_history. Returns a list of (operation, faces).'''
+    history = []
+    i = 0
+    while i < len(packed):
+        operation, count = Operation(packed[i]), packed[i + 1]
+        width = (count + 1) // 2
+        faces = []
+        for byte in packed[i + 2:i + 2 + width]:
+            faces += [byte >> 4, byte & 0x0F]
+        history.append((operation, faces[:count]))
+        i += 2 + width
+    return history
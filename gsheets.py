@@ -0,0 +1,144 @@
+import asyncio
+from urllib.parse import quote
+
+import aiohttp
+from google.oauth2 import service_account
+from google.auth.transport.requests import Request
+
+from quota import CircuitOpen, QuotaGovernor
+
+
+# Necessary permissions to interact with google sheets.
+SCOPES = ['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/drive.metadata.readonly']
+
+SHEETS_API_URL = 'https://sheets.googleapis.com/v4/spreadsheets'
+DRIVE_API_URL = 'https://www.googleapis.com/drive/v3/files'
+
+# Connections kept open to the API. Pulls and writes for every cached sheet share these.
+CONNECTION_LIMIT = 20
+
+
+class SheetsError(Exception):
+    '''A non-2xx answer from the Sheets API. status is the HTTP status code, or None if there was no answer.'''
+    def __init__(self, status, message):
+        super().__init__(f'{status}: {message}' if status is not None else message)
+        self.status = status
+        self.message = message
+
+
+    @property
+    def transient(self):
+        '''Google being busy or degraded, rather than anything wrong with the call.'''
+        return self.status is None or self.status == 429 or self.status >= 500
+
+
+
+class SheetsClient():
+    '''
+    A small asyncio client for the Sheets v4 REST API.
+
+    Values are read and written by spreadsheet key and A1 range, straight off the values endpoints, so a
+    pull is one HTTP call and a batch of writes is one more. Everything goes through a single pooled
+    aiohttp session, and nothing runs in a thread, except for the access token refresh, about once an hour.
+
+    Every call goes through a QuotaGovernor (see quota.py). While Google is degraded, calls fail fast with
+    a transient SheetsError.
+
+    base_url (and drive_url, for file metadata) can point at a local stub server, in which case creds_path
+    can be left out, and no token is sent.'''
+    def __init__(self, creds_path=None, base_url=None, governor=None, drive_url=None):
+        self.creds_path = creds_path
+        self.base_url = (base_url or SHEETS_API_URL).rstrip('/')
+        self.drive_url = (drive_url or DRIVE_API_URL).rstrip('/')
+        self.credentials = None
+        self.session = None
+        self.token_lock = asyncio.Lock()
+        self.governor = governor or QuotaGovernor(transient=lambda e: isinstance(e, SheetsError) and e.transient)
+
+
+    async def authenticate(self):
+        '''Loads the service account, and fetches a first token. Doubles as a check that the credentials work.'''
+        await self._headers()
+
+
+    async def _headers(self):
+        if not self.creds_path:
+            return {}
+        async with self.token_lock:
+            if not self.credentials:
+                self.credentials = service_account.Credentials.from_service_account_file(self.creds_path, scopes=SCOPES)
+            if not self.credentials.valid:
+                # google-auth only refreshes synchronously. It's rare enough to just hand to a thread.
+                await asyncio.get_event_loop().run_in_executor(None, self.credentials.refresh, Request())
+        return {'Authorization': f'Bearer {self.credentials.token}'}
+
+
+    def _session(self):
+        if not self.session or self.session.closed:
+            self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=CONNECTION_LIMIT))
+        return self.session
+
+
+    async def _request(self, method, path, params=None, body=None, base_url=None):
+        url = f'{base_url or self.base_url}/{path}'
+        call = lambda: self._send(method, url, params, body)
+        try:
+            # Identical reads in flight at once share a single request
+            if method == 'GET':
+                return await self.governor.read((url, repr(params)), call)
+            return await self.governor.write(call)
+        except CircuitOpen:
+            raise SheetsError(None, 'Google Sheets is degraded, backing off.')
+
+
+    async def _send(self, method, url, params, body):
+        try:
+            async with self._session().request(method, url, params=params, json=body, headers=await self._headers()) as response:
+                if response.status >= 400:
+                    try:
+                        message = (await response.json())['error']['message']
+                    except Exception:
+                        message = response.reason
+                    raise SheetsError(response.status, message)
+                return await response.json()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise SheetsError(None, str(e) or type(e).__name__)
+
+
+    async def get_sheet_properties(self, key):
+        '''spreadsheets.get, trimmed down to each tab's id (gid) and title.'''
+        result = await self._request('GET', key, params={'fields': 'sheets.properties(sheetId,title)'})
+        return [sheet['properties'] for sheet in result.get('sheets', [])]
+
+
+    async def get_modified_time(self, key):
+        '''When the spreadsheet last changed, from drive's file metadata. Far cheaper than pulling it to see.'''
+        result = await self._request('GET', key, params={'fields': 'modifiedTime'}, base_url=self.drive_url)
+        return result.get('modifiedTime')
+
+
+    async def get_values(self, key, cell_range):
+        '''values.get - rows of formatted values. Trailing empty rows and cells are left off, as the API does.'''
+        result = await self._request('GET', f'{key}/values/{quote(cell_range, safe="")}')
+        return result.get('values', [])
+
+
+    async def batch_get_values(self, key, cell_ranges):
+        '''values.batchGet - one list of rows per range, in order.'''
+        result = await self._request('GET', f'{key}/values:batchGet', params=[('ranges', r) for r in cell_ranges])
+        return [value_range.get('values', []) for value_range in result.get('valueRanges', [])]
+
+
+    async def batch_update_values(self, key, values_by_range):
+        '''values.batchUpdate - writes a single value to each range. Values are entered as if typed in.'''
+        body = {
+            'valueInputOption': 'USER_ENTERED',
+            'data': [{'range': cell_range, 'values': [[value]]} for cell_range, value in values_by_range.items()]
+        }
+        return await self._request('POST', f'{key}/values:batchUpdate', body=body)
+
+
+    async def close(self):
+        if self.session:
+            await self.session.close()
+            self.session = None
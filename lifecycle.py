@@ -0,0 +1,191 @@
+import asyncio
+import time
+
+
+# How often every subsystem is checked on, and how long a check gets before it counts as failed
+HEALTH_CHECK_SECONDS = 60
+HEALTH_CHECK_TIMEOUT = 10
+
+# Reconnects kept for !status, most recent last
+RECONNECT_HISTORY = 10
+
+
+def _seconds(seconds):
+    if seconds is None:
+        return '?'
+    if seconds < 60:
+        return f'{seconds:.1f}s'
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f'{hours}h {minutes}m' if hours else f'{minutes}m {seconds}s'
+
+
+
+class Lifecycle():
+    '''
+    Keeps the bot's startup work to once per process, however many times discord says it's ready.
+
+    discord.py calls on_ready again whenever the gateway reconnects (and on_resumed when it picks up where it
+    left off). Setup steps go through once(), which runs each step by name a single time - anyone else asking
+    for it just waits on the first run, and a step that failed is tried again next time. Along the way it
+    keeps timings: each step, time until first ready, and how long every disconnect lasted.
+
+    In the background, each subsystem's health check runs every so often. A check is an async function that
+    returns a short detail, or raises if something's wrong.
+
+    On the way out, stopping is set, so nothing new gets started, and drain() waits for whatever's already
+    in flight.'''
+    def __init__(self):
+        self.started_at = time.monotonic()
+        # step name --> its task, and once it's done, how long it took
+        self.steps = {}
+        self.timings = {}
+        self.ready_after = None
+        self.disconnected_at = None
+        # (how it came back - 'resumed', or 'reconnected', seconds it was down)
+        self.reconnects = []
+        self.reconnect_count = 0
+        # name --> check, and name --> (ok, detail, seconds the check took)
+        self.checks = {}
+        self.health = {}
+        self.checked_at = None
+        self.health_task = None
+        # Handlers (commands, reactions) currently running
+        self.stopping = False
+        self.in_flight = set()
+
+
+    def start(self, name, setup):
+        '''Starts a step in the background, unless it's already been started (or done).'''
+        if name not in self.steps:
+            task = asyncio.ensure_future(self._run(name, setup))
+            # Failures are reported by _run. Don't complain about them again, unretrieved.
+            task.add_done_callback(lambda _: _.cancelled() or _.exception())
+            self.steps[name] = task
+        return self.steps[name]
+
+
+    async def once(self, name, setup):
+        '''Runs a step, the first time it's asked for. Every time after, it's already done.'''
+        return await asyncio.shield(self.start(name, setup))
+
+
+    async def _run(self, name, setup):
+        began = time.monotonic()
+        try:
+            result = await setup()
+        except Exception as e:
+            print(f'Startup step "{name}" failed: {e}')
+            del self.steps[name]
+            raise
+        self.timings[name] = time.monotonic() - began
+        return result
+
+
+    def ready(self):
+        '''The gateway's ready. The first time, that's startup done. Any other time, it's a full reconnect.'''
+        if self.ready_after is None:
+            self.ready_after = time.monotonic() - self.started_at
+        else:
+            self._back('reconnected')
+
+
+    def resumed(self):
+        self._back('resumed')
+
+
+    def disconnected(self):
+        if self.disconnected_at is None:
+            self.disconnected_at = time.monotonic()
+
+
+    def _back(self, how):
+        down = time.monotonic() - self.disconnected_at if self.disconnected_at is not None else None
+        self.disconnected_at = None
+        self.reconnect_count += 1
+        self.reconnects = (self.reconnects + [(how, down)])[-RECONNECT_HISTORY:]
+
+
+    def track(self):
+        '''Counts the current task as in flight, until it's done.'''
+        task = asyncio.current_task()
+        self.in_flight.add(task)
+        task.add_done_callback(self.in_flight.discard)
+
+
+    async def drain(self, timeout):
+        '''Waits up to timeout for everything in flight to finish. Returns how many didn't.'''
+        pending = self.in_flight - {asyncio.current_task()}
+        if pending:
+            _, pending = await asyncio.wait(pending, timeout=timeout)
+        return len(pending)
+
+
+    def stop(self):
+        '''No more health checks, and no more unfinished setup (a prefetch, say).'''
+        self.stop_health_checks()
+        for task in self.steps.values():
+            task.cancel()
+
+
+    def add_check(self, name, check):
+        self.checks[name] = check
+
+
+    def start_health_checks(self):
+        if not self.health_task:
+            self.health_task = asyncio.ensure_future(self._check_health())
+
+
+    def stop_health_checks(self):
+        if self.health_task:
+            self.health_task.cancel()
+            self.health_task = None
+
+
+    async def _check_health(self):
+        while True:
+            await self.check_health()
+            await asyncio.sleep(HEALTH_CHECK_SECONDS)
+
+
+    async def check_health(self):
+        results = await asyncio.gather(*[self._check(check) for check in self.checks.values()])
+        self.health = dict(zip(self.checks, results))
+        self.checked_at = time.monotonic()
+
+
+    async def _check(self, check):
+        began = time.monotonic()
+        try:
+            detail = await asyncio.wait_for(check(), HEALTH_CHECK_TIMEOUT)
+            ok = True
+        except asyncio.TimeoutError:
+            detail, ok = 'timed out', False
+        except Exception as e:
+            detail, ok = str(e) or type(e).__name__, False
+        return ok, detail, time.monotonic() - began
+
+
+    def render(self):
+        '''For !status.'''
+        now = time.monotonic()
+        steps = ', '.join([f'{name} {_seconds(seconds)}' for name, seconds in self.timings.items()])
+        pending = [name for name in self.steps if name not in self.timings]
+        lines = [f'Up {_seconds(now - self.started_at)}. Ready {_seconds(self.ready_after)} after starting.']
+        if steps:
+            lines.append(f'Startup: {steps}.')
+        if pending:
+            lines.append(f'Still starting: {", ".join(pending)}.')
+
+        if self.disconnected_at is not None:
+            lines.append(f'Disconnected for {_seconds(now - self.disconnected_at)} now.')
+        if self.reconnects:
+            recent = ', '.join([f'{how} after {_seconds(down)}' for how, down in reversed(self.reconnects)])
+            lines.append(f'Reconnects: {self.reconnect_count} (latest first: {recent}).')
+
+        if self.checked_at is not None:
+            lines.append(f'Health, as of {_seconds(now - self.checked_at)} ago:')
+            for name, (ok, detail, seconds) in self.health.items():
+                lines.append(f"  {'✅' if ok else '⚠️'} {name} - {detail} ({seconds * 1000:.0f}ms)")
+        return '\n'.join(lines)
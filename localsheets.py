@@ -0,0 +1,131 @@
+# Character sheets kept as local files, instead of on google. Same layout as the google sheet (see cells.py),
+# in one of a few formats:
+#
+#   .json - an object of cell --> value, like {"S7": "Reepicheep", "F4": 4, "H59": true}
+#   .csv  - the sheet's grid, one line per row
+#   .ods  - an OpenDocument spreadsheet. Uses the "Character Sheet" tab, or the first one. Read only.
+
+import csv
+import json
+import os
+import zipfile
+import xml.etree.ElementTree as ElementTree
+
+
+LOCAL_SHEET_EXTENSIONS = ('.json', '.csv', '.ods')
+
+# The sheet layout doesn't reach past this. Anything further out in a file is ignored.
+MAX_ROWS = 200
+MAX_COLUMNS = 26
+
+ODS_TABLE = '{urn:oasis:names:tc:opendocument:xmlns:table:1.0}'
+ODS_OFFICE = '{urn:oasis:names:tc:opendocument:xmlns:office:1.0}'
+ODS_TEXT = '{urn:oasis:names:tc:opendocument:xmlns:text:1.0}'
+
+
+def is_local_sheet(key):
+    return bool(key) and key.lower().endswith(LOCAL_SHEET_EXTENSIONS)
+
+
+def resolve_path(root, path):
+    '''The real path to a sheet file under root. None if it isn't under root (or there is no root).'''
+    if not root or not path:
+        return None
+    root = os.path.realpath(root)
+    resolved = os.path.realpath(os.path.join(root, path))
+    return resolved if os.path.commonpath([root, resolved]) == root else None
+
+
+def _to_text(value):
+    if value is True or value is False:
+        return 'TRUE' if value else 'FALSE'
+    return '' if value is None else str(value)
+
+
+def _put(grid, cell, value):
+    row = int(cell[1:]) - 1
+    col = ord(cell[0].upper()) - ord('A')
+    grid.extend([] for _ in range(row + 1 - len(grid)))
+    grid[row].extend('' for _ in range(col + 1 - len(grid[row])))
+    grid[row][col] = _to_text(value)
+
+
+def load_grid(path):
+    '''Rows of cell text, as the google API would return them.'''
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.json':
+        with open(path, 'r') as f:
+            cells = json.load(f)
+        grid = []
+        for cell, value in cells.items():
+            _put(grid, cell, value)
+        return grid
+    if extension == '.csv':
+        return [row[:MAX_COLUMNS] for row in _read_csv(path)[:MAX_ROWS]]
+    if extension == '.ods':
+        return _load_ods(path)
+    raise ValueError(f'Not a sheet file: {path}')
+
+
+def _read_csv(path):
+    with open(path, 'r', newline='') as f:
+        return list(csv.reader(f))
+
+
+def _load_ods(path):
+    with zipfile.ZipFile(path) as archive:
+        root = ElementTree.fromstring(archive.read('content.xml'))
+    tables = list(root.iter(f'{ODS_TABLE}table'))
+    if not tables:
+        return []
+    table = next((_ for _ in tables if _.get(f'{ODS_TABLE}name') == 'Character Sheet'), tables[0])
+
+    # Empty stretches are run-length encoded, and run out to the edges of the sheet. Only read what's needed.
+    grid = []
+    for row in table.iter(f'{ODS_TABLE}table-row'):
+        cells = []
+        for cell in row:
+            if cell.tag not in (f'{ODS_TABLE}table-cell', f'{ODS_TABLE}covered-table-cell'):
+                continue
+            repeat = int(cell.get(f'{ODS_TABLE}number-columns-repeated', 1))
+            cells.extend([_ods_text(cell)] * min(repeat, MAX_COLUMNS - len(cells)))
+            if len(cells) >= MAX_COLUMNS:
+                break
+        repeat = int(row.get(f'{ODS_TABLE}number-rows-repeated', 1))
+        grid.extend(list(cells) for _ in range(min(repeat, MAX_ROWS - len(grid))))
+        if len(grid) >= MAX_ROWS:
+            break
+    return grid
+
+
+def _ods_text(cell):
+    if cell.get(f'{ODS_OFFICE}value-type') == 'boolean':
+        return 'TRUE' if cell.get(f'{ODS_OFFICE}boolean-value') == 'true' else 'FALSE'
+    return '\n'.join([''.join(p.itertext()) for p in cell.iter(f'{ODS_TEXT}p')])
+
+
+def write_cells(path, writes):
+    '''Writes cell --> value into a sheet file. Returns False for formats that can't be written.'''
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.json':
+        with open(path, 'r') as f:
+            cells = json.load(f)
+        cells.update(writes)
+        _replace(path, lambda f: json.dump(cells, f, indent=2))
+        return True
+    if extension == '.csv':
+        # The whole file, not just the part the sheet layout reads. Anything else in it stays put.
+        grid = _read_csv(path)
+        for cell, value in writes.items():
+            _put(grid, cell, value)
+        _replace(path, lambda f: csv.writer(f).writerows(grid))
+        return True
+    return False
+
+
+def _replace(path, write):
+    # Written to the side, then swapped in, so a reader never sees half a file
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'w', newline='') as f:
+        write(f)
+    os.replace(temp_path, path)
@@ -1,11 +1,18 @@
 import re
+import math
+import signal
 import argparse
+import asyncio
 import yaml
 import discord
 
-from sheets import SheetManager
+from sheets import SheetManager, SKILLS
 from rolling import RollerManager
 from persist import DatabaseManager
+from lifecycle import Lifecycle
+from sessions import SessionRegistry
+from sharding import ShardRouter
+from slash import CommandTree, add_commands
 
 
 parser = argparse.ArgumentParser(description='Run the MiceDice bot.')
@@ -22,23 +29,40 @@ BOT_TOKEN = config['bot_token']
 SERVER_ID = config['server_id']
 
 DB_FILE_PATH = config['sqlite3_database_path']
+DATABASE_URL = config.get('database_url')
+
+# Optional sharding, for large servers. Leave unset to run a single, unsharded client.
+SHARD_COUNT = config.get('shard_count')
+SHARD_IDS = config.get('shard_ids')
 
 
 # Experimental Google Sheets integration
-GOOGLE_CREDS_JSON = config['google_service_account_creds']
-GOOGLE_SHEETS_URL = config['google_sheets_url']
+GOOGLE_CREDS_JSON = config.get('google_service_account_creds')
+GOOGLE_SHEETS_URL = config.get('google_sheets_url')
+# Optional. Points the sheets client at another Sheets v4 endpoint, like a local stub server.
+GOOGLE_SHEETS_API_URL = config.get('google_sheets_api_url')
+GOOGLE_DRIVE_API_URL = config.get('google_drive_api_url')
+
+# Optional. Character sheets can also be local files (json, csv, or ods) in this folder.
+LOCAL_SHEETS_DIR = config.get('local_sheets_dir')
 
 # Meh, I'll just use regexes to parse commands. Easy enough.
-ROLL_BUILD_REGEX = re.compile(r'^\!roll$')
+ROLL_BUILD_REGEX = re.compile(r'^\!roll(?: ([A-Za-z][A-Za-z ]*))?$')
 ROLL_REGEX = re.compile(r'\!roll (\d+)(?:\s?[Oo][Bb]\s?(\d))?(?: for ?(.+))?')
+BULK_ROLL_REGEX = re.compile(r'\!roll (\d+[^,]*(?:,\s*\d+[^,]*)+)$')
+ROLL_SPEC_REGEX = re.compile(r'\s*(\d+)(?:\s?[Oo][Bb]\s?(\d))?(?: for ?(.+?))?\s*$')
 PROFILE_REGEX = re.compile(r'\!profile (register|select|unregister|display)(?:\s(.+))?')
-RATING_REGEX = re.compile(r'\!(rating|progress)(?: (.+))? (.+)')
+VERSUS_REGEX = re.compile(r'\!versus((?: <@!?\d+>)+)(?: for ?(.+))?')
+STATS_REGEX = re.compile(r'\!stats(?: <@!?(\d+)>)?$')
+RATING_REGEX = re.compile(r'\!(rating|progress)(?: (pass|fail|tax|trait))? (.+)')
+PARTY_REGEX = re.compile(r'\!party(?: (.+))?$')
+STATUS_REGEX = re.compile(r'\!status$')
 
 USER_ID_REGEX = re.compile(r'<@!(\d+)>')
 
 # Catch-all regex. Doesn't look at args.
 # User attempted to use a command with bad syntax, or needs help.
-USAGE_REGEX = re.compile(r'\!(:?help|usage|roll|rating|progress)')
+USAGE_REGEX = re.compile(r'\!(:?help|usage|roll|rating|progress|stats|versus|party|status)')
 
 # Aliases for commands. Shortcuts. Alternates.
 ALIASES = {}
@@ -46,6 +70,16 @@ ALIASES = {}
 USE_ICON_EMOJIS = config['use_icon_emojis']
 USE_SHEETS = config['use_google_sheets']
 
+# Roll builders and profile selectors offer buttons. This brings back the old reaction emoji options.
+USE_REACTIONS = config.get('use_reactions', False)
+
+# /roll, /profile and /rating. With message_commands off, the bot never reads message content at all.
+SLASH_COMMANDS = config.get('slash_commands', True)
+MESSAGE_COMMANDS = config.get('message_commands', True)
+
+# On SIGTERM (or ctrl-c), how long to let in-flight work finish, and writes flush, before closing anyway.
+SHUTDOWN_TIMEOUT_SECONDS = config.get('shutdown_timeout_seconds', 20)
+
 # Translates a d6 --> MG d6
 # Default the emojis to just words for display purposes
 SNAKE_EMOJI = '🐍'
@@ -81,18 +115,132 @@ class MiceDice(discord.Client):
     This is basically a hack, but I've put a few hours into this code by now
     so I can't use the "I did it in a night" excuse as a crutch anymore.'''
 
-    def __init__(self):
-        super().__init__()
-        self.db = DatabaseManager(DB_FILE_PATH)
-        self.roller = RollerManager()
-        self.sheets = SheetManager(GOOGLE_CREDS_JSON, self.db)
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.lifecycle = Lifecycle()
+        self.router = ShardRouter(kwargs.get('shard_count'), kwargs.get('shard_ids'))
+        self.db = DatabaseManager(DB_FILE_PATH, DATABASE_URL)
+        # Open roll builders and profile selectors, by message
+        self.sessions = SessionRegistry()
+        self.sheets = SheetManager(GOOGLE_CREDS_JSON, self.db, GOOGLE_SHEETS_API_URL, LOCAL_SHEETS_DIR,
+                                   GOOGLE_DRIVE_API_URL, use_buttons=not USE_REACTIONS, sessions=self.sessions)
+        self.roller = RollerManager(self.sheets, self.db, use_buttons=not USE_REACTIONS, sessions=self.sessions)
+        self.tree = CommandTree(self)
+        if SLASH_COMMANDS:
+            add_commands(self, self.tree, use_sheets=USE_SHEETS)
+
+
+    async def setup_hook(self):
+        '''Runs once, before the first connection to the gateway. Reconnects never come back through here.'''
+        print("Initializing MiceDice...")
+        await self.lifecycle.once('database', self.db.initialize)
+        if USE_SHEETS:
+            try:
+                await self.start_sheets()
+            except Exception:
+                # Already reported. The bot can still roll without sheets - the health check tries again.
+                print('  Starting without sheets for now.')
+        if SLASH_COMMANDS:
+            await self.lifecycle.once('slash commands', self.sync_commands)
+
+        self.lifecycle.add_check('gateway', self.check_gateway)
+        self.lifecycle.add_check('database', self.db.ping)
+        if USE_SHEETS:
+            self.lifecycle.add_check('sheets', self.check_sheets)
+        self.lifecycle.add_check('sessions', self.check_sessions)
+        self.lifecycle.start_health_checks()
+
+
+    async def start_sheets(self):
+        await self.lifecycle.once('sheets', self.sheets.initialize)
+        self.lifecycle.start('prefetch', self.sheets.prefetch_all)
+
+
+    async def sync_commands(self):
+        # Commands are synced to the one server, which (unlike global commands) shows them right away
+        guild = discord.Object(id=SERVER_ID)
+        self.tree.copy_global_to(guild=guild)
+        try:
+            await self.tree.sync(guild=guild)
+        except discord.HTTPException as e:
+            print(f'Failed to sync slash commands (is the bot invited with the applications.commands scope?): {e}')
 
 
     async def on_ready(self):
-        print("Initializing MiceDice...")
-        await self.db.initialize()
-        await self.sheets.initialize()
-        print('MiceDice bot ready to play!')
+        # Also called after every reconnect. Everything's already set up by then.
+        first = self.lifecycle.ready_after is None
+        self.lifecycle.ready()
+        if first:
+            print('MiceDice bot ready to play!')
+
+
+    async def on_resumed(self):
+        self.lifecycle.resumed()
+
+
+    async def on_disconnect(self):
+        self.lifecycle.disconnected()
+
+
+    async def check_gateway(self):
+        if math.isnan(self.latency) or math.isinf(self.latency):
+            raise RuntimeError('no heartbeat')
+        return f'{self.latency * 1000:.0f}ms heartbeat'
+
+
+    async def check_sheets(self):
+        # Sheets didn't come up at startup (google was down, say). Keep trying, and stay unhealthy until it works.
+        if 'sheets' not in self.lifecycle.timings:
+            try:
+                await self.start_sheets()
+            except Exception as e:
+                raise RuntimeError(f'not started ({e})')
+        return await self.sheets.health()
+
+
+    async def check_sessions(self):
+        return f'{len(self.sessions)} open'
+
+
+    async def shutdown(self, timeout=SHUTDOWN_TIMEOUT_SECONDS):
+        '''
+        Drains the bot, so a restart loses nothing. New commands are turned away, what's in flight gets to
+        finish, open sessions are expired in one go, every pending write (sheets, and the roll log) is
+        flushed, and every connection is closed. Each step shares the one deadline.'''
+        deadline = asyncio.get_running_loop().time() + timeout
+        remaining = lambda: max(0, deadline - asyncio.get_running_loop().time())
+        print('Shutting down MiceDice...')
+        self.lifecycle.stopping = True
+
+        unfinished = await self.lifecycle.drain(remaining())
+        print(f'  Finished in-flight commands ({unfinished} cut off).')
+
+        expired = await self.sessions.expire_all(remaining())
+        expired_versus = await self.roller.expire_versus()
+        print(f'  Expired {expired} sessions, and {expired_versus} versus tests.')
+
+        self.lifecycle.stop()
+        if USE_SHEETS:
+            try:
+                unflushed = await asyncio.wait_for(self.sheets.flush_all(), remaining())
+                print(f'  Flushed sheet writes ({unflushed} sheets still pending).')
+            except asyncio.TimeoutError:
+                print('  Ran out of time flushing sheet writes.')
+        try:
+            await asyncio.wait_for(self.db.roll_log.flush(), remaining())
+            print('  Flushed the roll log.')
+        except asyncio.TimeoutError:
+            print(f'  Ran out of time flushing the roll log ({self.db.roll_log.queue.qsize()} rolls lost).')
+
+        await self.sheets.close()
+        await self.db.close()
+        await self.close()
+        print('Done.')
+
+
+    async def status(self, channel):
+        '''!status - startup and reconnect timings, and how each part of the bot is doing.'''
+        await channel.send(f'MiceDice status:\n```{self.lifecycle.render()}```')
 
 
     async def on_message(self, message):
@@ -100,6 +248,24 @@ class MiceDice(discord.Client):
         if message.author == self.user:
             return
 
+        # Another shard owns this guild's sessions
+        if not self.router.owns(message.guild.id if message.guild else None):
+            return
+
+        # On the way out. Nothing new.
+        if self.lifecycle.stopping:
+            return
+        self.lifecycle.track()
+
+        # Whoever's using commands is likely to roll soon. Get their sheet ready. (Not for chatter - a busy
+        # channel would spend the read quota on sheets nobody asked for.)
+        if USE_SHEETS and message.content.startswith('!'):
+            self.sheets.note_activity(message.author, message.channel)
+
+        # Slash commands only
+        if not MESSAGE_COMMANDS:
+            return
+
         # Ignore anything that doesn't start with the magic token
         if not message.content.startswith('!'):
             return
@@ -113,11 +279,29 @@ class MiceDice(discord.Client):
         m = ValueRetainingRegexMatcher(message.content)
         
         if m.match(ROLL_BUILD_REGEX):
-            await self.roller.create(message.author, message.channel)
+            # A known skill (or a close enough guess at one) gets its proper name. Anything else is just a label.
+            skill = m.group(1).strip().lower() if m.group(1) else None
+            skill = SKILLS.resolve(skill)[0] or skill if skill else None
+            await self.roller.create(message.author, message.channel, skill=skill)
+        elif m.match(BULK_ROLL_REGEX):
+            pools = []
+            for spec in m.group(1).split(','):
+                spec_match = ROLL_SPEC_REGEX.match(spec)
+                if not spec_match:
+                    return await self.usage(message)
+                pools.append({
+                    'num_dice': int(spec_match.group(1)),
+                    'obstacle': int(spec_match.group(2)) if spec_match.group(2) else None,
+                    'reason': spec_match.group(3)
+                })
+            await self.roller.create(message.author, message.channel, pools=pools)
         elif m.match(ROLL_REGEX):
             num_dice = int(m.group(1)) if m.group(1) else None
             obstacle = int(m.group(2)) if m.group(2) else None
             reason = m.group(3)
+            # A plain roll (no obstacle, no reason) from someone in an open versus test is their pool for it
+            if obstacle is None and reason is None and await self.roller.submit_versus(message.author, message.channel, num_dice):
+                return await message.add_reaction('✅')
             await self.roller.create(message.author, message.channel, num_dice=num_dice, obstacle=obstacle, reason=reason)
         elif m.match(PROFILE_REGEX):
             from util import get_sheets_key
@@ -134,40 +318,124 @@ class MiceDice(discord.Client):
                 await self.sheets.display(message.author, message.channel)
 
             
+        elif m.match(VERSUS_REGEX):
+            participants = list(dict.fromkeys(message.mentions))
+            if len(participants) < 2 and message.author not in participants:
+                participants.insert(0, message.author)
+            if len(participants) < 2:
+                return await self.usage(message)
+            await self.roller.start_versus(message.author, message.channel, participants, reason=m.group(2))
+        elif m.match(STATS_REGEX):
+            user = message.mentions[0] if m.group(1) and message.mentions else None
+            await self.roller.stats(message.channel, user=user)
         elif m.match(RATING_REGEX) and USE_SHEETS:
             progress = m.group(1) == 'progress'
-            skill = m.group(2)
-            sheet = await self.sheets.get_sheet(message.author)
-            await sheet.check_rating(skill, message.channel, message.author, progress=progress)
+            mark = m.group(2)
+            skill = m.group(3).strip().lower()
+            await self.sheets.check_rating(message.author, message.channel, skill, progress=progress, mark=mark)
+        elif m.match(PARTY_REGEX) and USE_SHEETS:
+            skill = m.group(1).strip().lower() if m.group(1) else None
+            await self.sheets.party(message.channel, skill=skill)
+        elif m.match(STATUS_REGEX):
+            await self.status(message.channel)
         elif m.match(USAGE_REGEX):
             await self.usage(message)
 
 
-    async def on_reaction_add(self, reaction, user):
-        # If the reaction was from this bot, ignore i
-        if user == self.user:
+    async def on_raw_reaction_add(self, payload):
+        await self.dispatch_reaction(payload, added=True)
+
+
+    async def on_raw_reaction_remove(self, payload):
+        await self.dispatch_reaction(payload, added=False)
+
+
+    async def dispatch_reaction(self, payload, added):
+        '''Raw reaction events fire whether or not the message is in the client's message cache, so
+        roll builders and profile selectors keep working on busy servers. Each session tallies its own
+        reactions from these, rather than relying on the hydrated reaction counts on the message.'''
+        # Buttons come in as interactions, straight to their session's view. Reactions mean nothing.
+        if not USE_REACTIONS:
             return
-        
-        # If the reaction was to a "roll build" comment, and the reactor is the owner of it...
-        if reaction.message.author.id == self.user.id:
-            await self.roller.handle_event(user, reaction)
-            await self.sheets.handle_event(user, reaction)
+
+        # If the reaction was from this bot, ignore it
+        if payload.user_id == self.user.id:
+            return
+
+        if not self.router.owns(payload.guild_id) or self.lifecycle.stopping:
+            return
+
+        self.lifecycle.track()
+        await self.sessions.dispatch(payload.message_id, payload.user_id, str(payload.emoji), added)
 
 
     async def usage(self, message):
         '''!help'''
         await message.channel.send('''```Usage:
-    !roll
+    !roll [skill]
     !roll <dice> [Ob <req>] [for <reason>]
+    !roll <dice> [Ob <req>] [for <reason>], <dice> ...
+    !versus <@player> [@player...] [for <reason>]
+    !stats [@player]
     !profile select
-    !profile register <url>
-    !profile unregister <url>
-    !profile display```''')
+    !profile register <url|path>
+    !profile unregister <url|path>
+    !profile display
+    !rating <skill>
+    !progress [pass|fail] <skill>
+    !progress tax nature
+    !progress trait <trait>
+    !party [skill]
+    !status```''')
+
+
+class ShardedMiceDice(MiceDice, discord.AutoShardedClient):
+    '''MiceDice, run as one or more shards in this process. Run several processes with disjoint shard_ids
+    (and a shared database_url) to spread really large servers out.'''
+    pass
+
+
+def create_client():
+    # Prefix commands are read out of message content, which is a privileged intent - turn it on for the
+    # bot, too. Reaction events are only worth the gateway traffic for the reaction UI.
+    intents = discord.Intents.default()
+    intents.message_content = MESSAGE_COMMANDS
+    intents.reactions = USE_REACTIONS
+    if SHARD_COUNT:
+        return ShardedMiceDice(intents=intents, shard_count=SHARD_COUNT, shard_ids=SHARD_IDS)
+    return MiceDice(intents=intents)
 
 
 def main():
-    client = MiceDice()
-    client.run(BOT_TOKEN)
+    asyncio.run(run())
+
+
+async def run(client=None):
+    '''Runs the bot until it's told to stop (SIGTERM, or ctrl-c), then shuts it down gracefully.'''
+    # Made in here, not before asyncio.run starts its loop. Before python 3.10, the client's locks and queues
+    # tie themselves to whichever loop is current when they're made.
+    client = client or create_client()
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            # No signal handlers on windows. Ctrl-c just stops it dead, there.
+            pass
+
+    discord.utils.setup_logging()
+    bot = asyncio.ensure_future(client.start(BOT_TOKEN))
+    stopping = asyncio.ensure_future(stop.wait())
+    await asyncio.wait([bot, stopping], return_when=asyncio.FIRST_COMPLETED)
+    if bot.done():
+        stopping.cancel()
+        # Didn't start, or lost the connection for good. Still, don't lose what's pending.
+        if not client.is_closed():
+            await client.shutdown()
+        return bot.result()
+    await client.shutdown()
+    await bot
 
 
 if __name__ == "__main__":
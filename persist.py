@@ -1,31 +1,235 @@
+import asyncio
+import re
+import time
+
 import aiosqlite
 
+from dice import pack_history
+
+# Optional. Only needed when profiles live in a shared postgres server (see database_url in the config).
+try:
+    import asyncpg
+except ImportError:
+    asyncpg = None
+
+
+class SqliteBackend():
+    '''A single sqlite3 file. Fine for one bot process, and the local stand-in for the shared store.'''
+    shared = False
+    primary_key = 'INTEGER PRIMARY KEY'
+    blob = 'BLOB'
+
+    def __init__(self, path):
+        self.path = path
+
+
+    async def connect(self):
+        pass
+
+
+    async def execute(self, sql, params=()):
+        async with aiosqlite.connect(self.path) as db:
+            cursor = await db.execute(sql, params)
+            await db.commit()
+            return cursor.rowcount
+
+
+    async def executemany(self, sql, params_seq):
+        async with aiosqlite.connect(self.path) as db:
+            await db.executemany(sql, params_seq)
+            await db.commit()
+
+
+    async def transaction(self, statements):
+        async with aiosqlite.connect(self.path) as db:
+            for sql, params in statements:
+                await db.execute(sql, params)
+            await db.commit()
+
+
+    async def fetchall(self, sql, params=()):
+        async with aiosqlite.connect(self.path) as db:
+            db.row_factory = aiosqlite.Row
+            async with db.execute(sql, params) as cursor:
+                return await cursor.fetchall()
+
+
+    async def fetchone(self, sql, params=()):
+        rows = await self.fetchall(sql, params)
+        return rows[0] if rows else None
+
+
+    async def close(self):
+        pass
+
+
+
+class PostgresBackend():
+    '''A postgres server shared by every bot process, so shards in separate processes agree on profiles.
+    Queries are written with sqlite style ? placeholders, and translated to $n here.'''
+    shared = True
+    primary_key = 'BIGSERIAL PRIMARY KEY'
+    blob = 'BYTEA'
+
+    def __init__(self, dsn):
+        if asyncpg is None:
+            raise RuntimeError('database_url is set, but asyncpg is not installed.')
+        self.dsn = dsn
+        self.pool = None
+
+
+    async def connect(self):
+        if not self.pool:
+            self.pool = await asyncpg.create_pool(self.dsn)
+
+
+    def _translate(self, sql):
+        count = iter(range(1, sql.count('?') + 1))
+        return re.sub(r'\?', lambda _: f'${next(count)}', sql)
+
+
+    async def execute(self, sql, params=()):
+        async with self.pool.acquire() as conn:
+            status = await conn.execute(self._translate(sql), *params)
+            # Status looks like 'DELETE 1', or 'INSERT 0 1'
+            return int(status.split()[-1]) if status.split()[-1].isdigit() else 0
+
+
+    async def executemany(self, sql, params_seq):
+        async with self.pool.acquire() as conn:
+            await conn.executemany(self._translate(sql), params_seq)
+
+
+    async def transaction(self, statements):
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                for sql, params in statements:
+                    await conn.execute(self._translate(sql), *params)
+
+
+    async def fetchall(self, sql, params=()):
+        async with self.pool.acquire() as conn:
+            return await conn.fetch(self._translate(sql), *params)
+
+
+    async def fetchone(self, sql, params=()):
+        async with self.pool.acquire() as conn:
+            return await conn.fetchrow(self._translate(sql), *params)
+
+
+    async def close(self):
+        if self.pool:
+            await self.pool.close()
+            self.pool = None
+
+
+
+class RollLog():
+    '''
+    Every finished roll, written to the ROLL_LOG table.
+
+    Rolls are queued, and a single writer drains the queue in batches, so logging never holds up a roll
+    and a busy table costs one insert per batch rather than one per roll. Dice history is stored packed
+    (see dice.pack_history), along with the seed the pool was rolled from.
+
+    The two indexes cover the stats queries outright, so those never touch the table itself.'''
+    BATCH_SIZE = 200
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.queue = asyncio.Queue()
+        self.task = None
+
+
+    async def initialize(self):
+        await self.backend.execute(f'''CREATE TABLE IF NOT EXISTS ROLL_LOG (id {self.backend.primary_key}, rolled_at bigint,
+            owner_id bigint, guild_id bigint, channel_id bigint, dice int, obstacle int, successes int, passed boolean,
+            seed bigint, history {self.backend.blob})''')
+        await self.backend.execute('CREATE INDEX IF NOT EXISTS ROLL_LOG_BY_CHANNEL ON ROLL_LOG (channel_id, owner_id, passed, successes)')
+        await self.backend.execute('CREATE INDEX IF NOT EXISTS ROLL_LOG_BY_OWNER ON ROLL_LOG (owner_id, channel_id, passed, successes)')
+        if not self.task:
+            self.task = asyncio.ensure_future(self._write_batches())
+
+
+    def record(self, owner, channel, pool, obstacle=None):
+        guild = getattr(channel, 'guild', None)
+        passed = pool.value() >= obstacle if obstacle else None
+        self.queue.put_nowait((int(time.time()), owner.id, guild.id if guild else None, channel.id, pool.size(),
+                               obstacle, pool.value(), passed, pool.seed, pack_history(pool)))
+
+
+    async def _write_batches(self):
+        while True:
+            batch = [await self.queue.get()]
+            while not self.queue.empty() and len(batch) < self.BATCH_SIZE:
+                batch.append(self.queue.get_nowait())
+            try:
+                await self.backend.executemany('''INSERT INTO ROLL_LOG (rolled_at, owner_id, guild_id, channel_id, dice,
+                    obstacle, successes, passed, seed, history) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', batch)
+            except Exception as e:
+                print(f'Failed to log {len(batch)} rolls: {e}')
+            for _ in batch:
+                self.queue.task_done()
+
+
+    async def flush(self):
+        await self.queue.join()
+
+
+    async def close(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+
+    async def get_campaign_stats(self, channel_id):
+        '''Per-player stats for a campaign (channel).'''
+        return await self.backend.fetchall('''SELECT owner_id, COUNT(*) AS rolls, COUNT(passed) AS tests,
+            SUM(CASE WHEN passed THEN 1 ELSE 0 END) AS passes, AVG(successes) AS average
+            FROM ROLL_LOG WHERE channel_id = ? GROUP BY owner_id ORDER BY rolls DESC''', (channel_id,))
+
+
+    async def get_campaign_players(self, channel_id):
+        '''Everyone who has rolled in a campaign (channel).'''
+        rows = await self.backend.fetchall('SELECT DISTINCT owner_id FROM ROLL_LOG WHERE channel_id = ?', (channel_id,))
+        return [row['owner_id'] for row in rows]
+
+
+    async def get_player_stats(self, owner_id):
+        '''Per-campaign (channel) stats for a player.'''
+        return await self.backend.fetchall('''SELECT channel_id, COUNT(*) AS rolls, COUNT(passed) AS tests,
+            SUM(CASE WHEN passed THEN 1 ELSE 0 END) AS passes, AVG(successes) AS average
+            FROM ROLL_LOG WHERE owner_id = ? GROUP BY channel_id ORDER BY rolls DESC''', (owner_id,))
+
+
 
 class DatabaseManager():
-    def __init__(self, sqlite3_file):
-        '''Given a sheets URL, and a list of player discord IDs, return a
-        dictionary of discord_id --> GoogleBackedSheet object'''
+    def __init__(self, sqlite3_file, database_url=None):
+        '''Profiles live in the sqlite3 file, unless a database_url points at a shared postgres server.
+        The shared server is what lets several bot processes (shards) run against the same profiles.'''
         self.dbpath = sqlite3_file
-    
+        self.backend = PostgresBackend(database_url) if database_url else SqliteBackend(sqlite3_file)
+        self.shared = self.backend.shared
+        self.roll_log = RollLog(self.backend)
+
 
     async def initialize(self):
-        async with aiosqlite.connect(self.dbpath) as db:
-            print("Connecting to and preparing SQLITE database...")
-            await db.execute('CREATE TABLE IF NOT EXISTS PLAYER_SHEETS (user_id int, sheets_key varchar(255), current boolean)')
-            print("Done.")
+        print("Connecting to and preparing database...")
+        await self.backend.connect()
+        await self.backend.execute('CREATE TABLE IF NOT EXISTS PLAYER_SHEETS (user_id bigint, sheets_key varchar(255), current boolean)')
+        await self.backend.execute(f'''CREATE TABLE IF NOT EXISTS SHEET_SNAPSHOTS (sheets_key varchar(255) PRIMARY KEY,
+            revision varchar(64), saved_at bigint, state {self.backend.blob})''')
+        await self.roll_log.initialize()
+        print("Done.")
+
 
-    
     async def _get_profile_keys(self, user):
-        urls = []
-        async with aiosqlite.connect(self.dbpath) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.execute(f'SELECT sheets_key FROM PLAYER_SHEETS WHERE user_id = {user.id}') as cursor:
-                urls = [row['sheets_key'] for row in await cursor.fetchall()]
-        return urls
+        rows = await self.backend.fetchall('SELECT sheets_key FROM PLAYER_SHEETS WHERE user_id = ?', (user.id,))
+        return [row['sheets_key'] for row in rows]
 
 
     async def get_profiles(self, user):
-        return self._get_profile_urls(user)
+        return await self._get_profile_keys(user)
 
 
     async def add_profile(self, user, key):
@@ -33,33 +237,60 @@ class DatabaseManager():
 
         if key in profile_keys:
             return False
-        
-        async with aiosqlite.connect(self.dbpath) as db:
-            await db.execute(f"INSERT INTO PLAYER_SHEETS (user_id, sheets_key) VALUES ({user.id}, '{key}')")
-            await db.commit()
+
+        await self.backend.execute('INSERT INTO PLAYER_SHEETS (user_id, sheets_key) VALUES (?, ?)', (user.id, key))
         return True
 
 
     async def delete_profile(self, user, key):
-        async with aiosqlite.connect(self.dbpath) as db:
-            await db.execute(f"DELETE FROM PLAYER_SHEETS WHERE user_id = {user.id} AND sheets_key = '{key}'")
-            await db.commit()
-            return db.total_changes > 0
+        deleted = await self.backend.execute('DELETE FROM PLAYER_SHEETS WHERE user_id = ? AND sheets_key = ?', (user.id, key))
+        return deleted > 0
 
 
     async def get_current(self, user):
-        async with aiosqlite.connect(self.dbpath) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.execute(f'SELECT sheets_key FROM PLAYER_SHEETS WHERE user_id = {user.id} AND current = TRUE') as cursor:
-                result = await cursor.fetchone()
-                return result['sheets_key'] if result else None
+        result = await self.backend.fetchone('SELECT sheets_key FROM PLAYER_SHEETS WHERE user_id = ? AND current = TRUE', (user.id,))
+        return result['sheets_key'] if result else None
+
+
+    async def get_all_current(self):
+        '''Every player's current profile, as rows of user_id, sheets_key.'''
+        return await self.backend.fetchall('SELECT user_id, sheets_key FROM PLAYER_SHEETS WHERE current = TRUE')
+
+
+    async def get_current_for(self, user_ids):
+        '''Current profiles for a group of players, as rows of user_id, sheets_key.'''
+        if not user_ids:
+            return []
+        placeholders = ', '.join(['?'] * len(user_ids))
+        return await self.backend.fetchall(
+            f'SELECT user_id, sheets_key FROM PLAYER_SHEETS WHERE current = TRUE AND user_id IN ({placeholders})', tuple(user_ids))
 
 
     async def update_current(self, user, key):
-        async with aiosqlite.connect(self.dbpath) as db:
-            await db.execute(f"UPDATE PLAYER_SHEETS SET current = FALSE WHERE user_id = {user.id} AND current = TRUE")
-            await db.commit()
-            await db.execute(f"UPDATE PLAYER_SHEETS SET current = TRUE WHERE user_id = {user.id} AND sheets_key = '{key}'")
-            await db.commit()
+        await self.backend.transaction([
+            ('UPDATE PLAYER_SHEETS SET current = FALSE WHERE user_id = ? AND current = TRUE', (user.id,)),
+            ('UPDATE PLAYER_SHEETS SET current = TRUE WHERE user_id = ? AND sheets_key = ?', (user.id, key))
+        ])
+
+
+    async def get_sheet_snapshots(self):
+        '''Every saved sheet snapshot, as rows of sheets_key, revision, state.'''
+        return await self.backend.fetchall('SELECT sheets_key, revision, state FROM SHEET_SNAPSHOTS')
+
+
+    async def save_sheet_snapshot(self, key, revision, state):
+        await self.backend.execute('''INSERT INTO SHEET_SNAPSHOTS (sheets_key, revision, saved_at, state) VALUES (?, ?, ?, ?)
+            ON CONFLICT (sheets_key) DO UPDATE SET revision = excluded.revision, saved_at = excluded.saved_at,
+            state = excluded.state''', (key, revision, int(time.time()), state))
+
+
+    async def ping(self):
+        '''Health check. A trivial query, and how far behind the roll log is.'''
+        await self.backend.fetchone('SELECT 1')
+        return f'{self.roll_log.queue.qsize()} rolls waiting to be logged'
 
 
+    async def close(self):
+        '''Flush the roll log first (see RollLog.flush), or whatever's still queued is lost.'''
+        await self.roll_log.close()
+        await self.backend.close()
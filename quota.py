@@ -0,0 +1,163 @@
+import asyncio
+import random
+import time
+
+
+# Google's default Sheets quota is 60 reads and 60 writes a minute, per user - and the service account is the
+# one user. Each bucket refills a little under that, and bursts a little, so a full minute can't go over.
+READS_PER_MINUTE = 55
+WRITES_PER_MINUTE = 55
+BURST = 5
+
+# Backoff between attempts, in seconds. Full jitter, doubling up to the cap.
+RETRIES = 4
+BACKOFF_BASE = 1
+BACKOFF_CAP = 16
+
+# This many failures in a row, and calls stop going out at all for a while.
+BREAKER_THRESHOLD = 5
+BREAKER_RESET_SECONDS = 30
+
+
+class CircuitOpen(Exception):
+    '''The breaker is open. The call was never made.'''
+    pass
+
+
+
+class TokenBucket():
+    '''rate tokens a second, up to capacity. acquire() waits its turn for one, try_acquire() doesn't wait.'''
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+    def try_acquire(self):
+        '''Takes a token if there's one right now. Returns whether it did. Never jumps ahead of a waiter.'''
+        if self.lock.locked():
+            return False
+        self._refill()
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+
+class SingleFlight():
+    '''Concurrent calls under the same key share one run of the first caller's call, and its result.'''
+    def __init__(self):
+        self.calls = {}
+
+
+    async def run(self, key, call):
+        if key not in self.calls:
+            future = asyncio.ensure_future(call())
+            self.calls[key] = future
+            future.add_done_callback(lambda _: self.calls.pop(key, None))
+        # Shielded, so one caller giving up doesn't cancel the call for everyone else
+        return await asyncio.shield(self.calls[key])
+
+
+
+class CircuitBreaker():
+    '''
+    Closed, until threshold failures in a row. Then open - nothing is allowed - for reset_seconds.
+
+    After that, one trial call is let through (half open). It succeeding closes the breaker, and it failing
+    keeps it open for another reset_seconds.'''
+    def __init__(self, threshold, reset_seconds):
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+
+
+    def is_open(self):
+        return self.opened_at is not None
+
+
+    def allow(self):
+        if self.opened_at is None:
+            return True
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            # Half open. Restart the clock, so only this call gets through until it's known how it went.
+            self.opened_at = time.monotonic()
+            return True
+        return False
+
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+
+
+    def record_failure(self):
+        self.failures += 1
+        if self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+
+
+
+class QuotaGovernor():
+    '''
+    Sits in front of every call to a rate limited API.
+
+    Reads and writes each draw from their own token bucket. A call failing in a way transient() says is
+    worth retrying (rate limited, server trouble) is retried with jittered exponential backoff. Identical
+    reads in flight at the same time are merged into one. And if the API keeps failing, the breaker opens,
+    and calls fail fast with CircuitOpen instead of piling on - callers are expected to fall back on
+    whatever they last got.'''
+    def __init__(self, transient=lambda e: True, reads_per_minute=READS_PER_MINUTE,
+                 writes_per_minute=WRITES_PER_MINUTE, burst=BURST):
+        self.transient = transient
+        self.reads = TokenBucket(reads_per_minute / 60, burst)
+        self.writes = TokenBucket(writes_per_minute / 60, burst)
+        self.flights = SingleFlight()
+        self.breaker = CircuitBreaker(BREAKER_THRESHOLD, BREAKER_RESET_SECONDS)
+
+
+    async def read(self, key, call):
+        return await self.flights.run(key, lambda: self._run(self.reads, call))
+
+
+    async def write(self, call):
+        return await self._run(self.writes, call)
+
+
+    async def _run(self, bucket, call):
+        for attempt in range(RETRIES + 1):
+            if not self.breaker.allow():
+                raise CircuitOpen()
+            await bucket.acquire()
+            try:
+                result = await call()
+            except Exception as e:
+                if not self.transient(e):
+                    raise
+                self.breaker.record_failure()
+                if attempt == RETRIES or self.breaker.is_open():
+                    raise
+                await asyncio.sleep(random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt)))
+                continue
+            self.breaker.record_success()
+            return result
@@ -1,18 +1,28 @@
 import asyncio
 from decimal import Decimal, ROUND_HALF_UP
 from abc import ABC, abstractmethod
+from typing import Callable, NamedTuple
+
+import discord
 
 from dice import DicePool
-from util import render_dice_pool
+from sessions import Session, SessionRegistry
+from sharding import partition_key
+from util import render_dice_pool, ReactionTally, SessionView
+from versus import VersusTest
 
 
 # mapping of emoji to numeric value
 NUM_MAP = {'0️⃣': 0, '1️⃣': 1, '2️⃣': 2, '3️⃣': 3, '4️⃣': 4, '5️⃣': 5, '6️⃣': 6, '7️⃣': 7}
+EMOJI_MAP = {value: emoji for emoji, value in NUM_MAP.items()}
 
 # 30 max is beyond reasonable, and is spammy enough
 # https://forums.burningwheel.com/t/maximum-of-dice/8561/6
 MAXIMUM_NUMBER_OF_DICE = 30
 
+# Most pools in one bulk roll. Keeps the table well under discord's message length limit.
+MAXIMUM_NUMBER_OF_POOLS = 10
+
 
 class RollerManager():
     '''
@@ -22,40 +32,55 @@ class RollerManager():
     In both cases, a "roll" message is a response to a !roll command from a user, which will have roll
     results present in it.
 
-    Basic rollers are more or less a one-and-done roll. They set up a dice pool, resolve immediately, and
-    return the result in edited message form.
+    Basic (and bulk) rollers are one-shot rolls. They set up a dice pool, resolve immediately, and send the
+    result as a single message - no placeholder, and no edit.
 
     Interactive rollers modify the original response message with questions and information to help guide
     a user to give it the information necessary to compute what to roll per Mouse Guard RPG rules. As such
     they are very stateful. The bot populates these messages with valid emoji choices that the user can
-    click to respond to questions, giving information to the bot. These messages remain "open" until the
-    roll is cancelled, or is completed. This manager retains caches for "open" roll messages.'''
-    def __init__(self):
-        # Caches for roll "builders".
+    click to respond to questions, giving information to the bot. The choices are buttons, or with
+    use_buttons off, reactions. These messages remain "open" until the
+    roll is cancelled, or is completed. This manager retains caches for "open" roll messages.
+
+    When the roller has a player's sheet on hand, finished rolls write their progress (pass/fail ticks,
+    nature tax) back to it.
+
+    The manager also runs versus tests, where several players' pools are rolled off against each other.
+    While a player has a versus test waiting on them, their next plain roll counts as their pool for it - a
+    quick roll with just dice, or whatever a roll builder ends up with.'''
+    def __init__(self, sheets=None, db=None, use_buttons=False, sessions=None):
+        self.sheets = sheets
+        self.db = db
+        self.use_buttons = use_buttons
+
+        # Caches for roll "builders". By message, in the registry shared with the sheet manager, and by request here.
+        self.sessions = sessions if sessions is not None else SessionRegistry()
         self.roll_cache_by_request = {}
-        self.roll_cache_by_message = {}
         self.lock = asyncio.Lock()
 
+        # Open versus tests, by the request key of each participant still to submit.
+        self.versus_by_request = {}
+
 
     def _generate_request_key(self, user, channel):
-        return str(user.id) + "_" + str(channel.id)
+        return partition_key(channel) + "_" + str(user.id)
 
 
     async def uncache_roll(self, roll):
         async with self.lock:
-            key = self._generate_request_key(roll.owner, roll.message)
-            del self.roll_cache_by_message[roll.message.id]
+            key = self._generate_request_key(roll.owner, roll.channel)
+            self.sessions.unregister(roll)
             del self.roll_cache_by_request[key]
 
 
     async def cache_roll(self, roll):
         async with self.lock:
-            key = self._generate_request_key(roll.owner, roll.message)
-            self.roll_cache_by_message[roll.message.id] = roll
+            key = self._generate_request_key(roll.owner, roll.channel)
+            self.sessions.register(roll)
             self.roll_cache_by_request[key] = roll
 
 
-    async def create(self, user, channel, **kwargs):
+    async def create(self, user, channel, skill=None, **kwargs):
         roll = None
         if not kwargs:
             # If there's a previously open roll builder session, close it out
@@ -64,48 +89,109 @@ class RollerManager():
                 await self.roll_cache_by_request[key].cancel()
             
             # make a new builder session, and add it to the caches
-            roll = InteractiveRoller(self, user, channel)
+            roll = InteractiveRoller(self, user, channel, skill=skill)
             await roll.initialize()
             await self.cache_roll(roll)
         else:
-            roll = BasicRoller(self, user, channel, **kwargs)
-            await roll.initialize()
+            # One-shot rolls are never cached, and go out as a single message with the final result.
+            roll = BulkRoller(self, user, channel, **kwargs) if 'pools' in kwargs else BasicRoller(self, user, channel, **kwargs)
+            if not roll.is_valid():
+                await channel.send(f"🔴 - I'm afraid I can't do that, {user.mention}.")
+                return
         
         await roll.next()
 
 
-    async def handle_event(self, user, reaction):
-        # If not a "roll" message, bail
-        if reaction.message.id not in self.roll_cache_by_message:
-            return
-        
-        # If the reaction is from the owner, and a valid option, interpet it. Otherwise, purge.
-        roll = self.roll_cache_by_message[reaction.message.id]
+    def log_roll(self, roll, obstacle=None):
+        self.log_pool(roll.owner, roll.channel, roll.pool, obstacle=obstacle)
 
-        # Exception - other players can offer help for that one step
-        if roll.getting_helpers:
-            if reaction.emoji == '✋' and roll.owner.id != user.id:
-                return
-            elif reaction.emoji == '✋' and roll.owner.id == user.id:
-                return await reaction.remove(user)
 
-        if roll.owner.id == user.id and reaction.count > 1:
-            await roll.next(reaction=reaction)
+    def log_pool(self, owner, channel, pool, obstacle=None):
+        if self.db:
+            self.db.roll_log.record(owner, channel, pool, obstacle=obstacle)
+
+
+    async def start_versus(self, owner, channel, participants, reason=None):
+        # Anyone already in an open test in this channel gets pulled out of it.
+        for participant in participants:
+            previous = self.versus_by_request.get(self._generate_request_key(participant, channel))
+            if previous:
+                await previous.cancel()
+
+        versus = VersusTest(self, owner, channel, participants, reason=reason)
+        await versus.initialize()
+        for participant in participants:
+            self.versus_by_request[self._generate_request_key(participant, channel)] = versus
+
+
+    async def expire_versus(self):
+        '''Closes out every open versus test. Returns how many there were.'''
+        open_tests = {id(_): _ for _ in self.versus_by_request.values()}.values()
+        await asyncio.gather(*[versus.cancel(reason='expired') for versus in open_tests], return_exceptions=True)
+        return len(open_tests)
+
+
+    def end_versus(self, versus):
+        for participant in versus.participants:
+            key = self._generate_request_key(participant, versus.channel)
+            if self.versus_by_request.get(key) is versus:
+                del self.versus_by_request[key]
+
+
+    async def submit_versus(self, user, channel, num_dice=None, pool=None):
+        '''
+        Counts a roll towards the user's open versus test, if they have one. Returns whether it did.
+
+        A quick roll gives its number of dice, and the test rolls them. A roll builder gives its finished
+        pool, already rolled (and exploded, rerolled, and so on), which stands as it is.'''
+        versus = self.versus_by_request.get(self._generate_request_key(user, channel))
+        size = pool.size() if pool is not None else num_dice
+        if not versus or not versus.is_waiting_on(user) or size < 1 or size > MAXIMUM_NUMBER_OF_DICE:
+            return False
+        await versus.submit(user, pool if pool is not None else DicePool(num_dice))
+        return True
+
+
+    async def stats(self, channel, user=None):
+        '''!stats - success rates for everyone in this campaign (channel), or for one player across campaigns.'''
+        if user:
+            rows = await self.db.roll_log.get_player_stats(user.id)
+            header = f'{user.mention}\'s rolls, by campaign:'
+            lines = [f'> <#{row["channel_id"]}> - {self._render_stats(row)}' for row in rows]
         else:
-            await reaction.remove(user)
+            rows = await self.db.roll_log.get_campaign_stats(channel.id)
+            header = 'Rolls in this campaign, by player:'
+            lines = [f'> <@{row["owner_id"]}> - {self._render_stats(row)}' for row in rows]
+
+        if not lines:
+            lines = ['> No rolls logged yet.']
+        await channel.send('\n'.join([header] + lines), allowed_mentions=discord.AllowedMentions.none())
+
+
+    def _render_stats(self, row):
+        rate = f'{row["passes"] / row["tests"]:.0%}' if row['tests'] else 'n/a'
+        return f'**{row["passes"]}/{row["tests"]}** tests passed ({rate}), {row["rolls"]} rolls, {row["average"]:.1f} successes on average'
+
+
 
 
 class Roller(ABC):
+    # Rollers live as long as their message does, and a busy server holds a lot of them. Slots keep each one small.
+    __slots__ = ('manager', 'owner', 'channel', 'pool', 'lock', 'options', 'tally', 'message', 'view')
+
     def __init__(self, manager, owner, channel):
         self.manager = manager
         self.owner = owner
         self.channel = channel
         self.pool = DicePool()
         self.lock = asyncio.Lock()
+        self.options = set()
+        self.tally = ReactionTally()
+        self.view = None
 
 
     async def initialize(self):
-        self.message = await self.channel.send(f'{self.owner.mention}\'s roll: Initializing...')
+        pass
 
 
     @abstractmethod
@@ -114,7 +200,40 @@ class Roller(ABC):
 
 
 
-class BasicRoller(Roller):
+class OneShotRoller(Roller):
+    '''A roll that resolves immediately. Nothing to set up, and no placeholder to edit later - the dice are
+    rolled up front, and the result sent as the one and only message. Only once it's been posted does the
+    roll count: logged, and marked on the roller's sheet.'''
+    __slots__ = ()
+
+    def is_valid(self):
+        return True
+
+
+    @abstractmethod
+    def roll(self):
+        pass
+
+
+    @abstractmethod
+    def render(self):
+        pass
+
+
+    def record(self):
+        pass
+
+
+    async def next(self):
+        self.roll()
+        self.message = await self.channel.send(self.render())
+        self.record()
+
+
+
+class BasicRoller(OneShotRoller):
+    __slots__ = ('num_dice', 'obstacle', 'reason')
+
     def __init__(self, manager, owner, channel, num_dice, obstacle=None, reason=None):
         super().__init__(manager, owner, channel)
         self.num_dice = num_dice
@@ -122,13 +241,16 @@ class BasicRoller(Roller):
         self.reason = reason
 
 
-    async def next(self):
-        if self.num_dice < 1 or self.num_dice > MAXIMUM_NUMBER_OF_DICE:
-            return await self.message.edit(content=f"🔴 - I'm afraid I can't do that, {self.owner.mention}.")
+    def is_valid(self):
+        return 1 <= self.num_dice <= MAXIMUM_NUMBER_OF_DICE
+
 
+    def roll(self):
         self.pool.add_dice(self.num_dice)
         self.pool.roll()
 
+
+    def render(self):
         reason_portion = ''
         if self.reason:
             reason_portion = ' **for ' + self.reason + '**'          
@@ -136,386 +258,664 @@ class BasicRoller(Roller):
         if self.obstacle:
             successful = self.pool.value() >= self.obstacle
             obstacle_portion = f"{' '*8}**(Ob {self.obstacle})**  {'🎉' if successful else '💀'}"
+            if self._progress_skill()[1]:
+                obstacle_portion += f"  *({'pass' if successful else 'fail'} marked)*"
         quantity_portion = f"**{self.num_dice}** {'dice' if self.num_dice > 1 else 'die'}"
         result_portion = f"{render_dice_pool(self.pool)}"
-        msg = f'{self.owner.mention} rolls {quantity_portion}{reason_portion}!\n>>> {result_portion}{obstacle_portion}'
-        await self.message.edit(content=msg)
+        return f'{self.owner.mention} rolls {quantity_portion}{reason_portion}!\n>>> {result_portion}{obstacle_portion}'
 
 
+    def record(self):
+        self.manager.log_roll(self, obstacle=self.obstacle)
+        sheet, skill = self._progress_skill()
+        if skill:
+            sheet.mark_test(skill, self.pool.value() >= self.obstacle)
 
-class InteractiveRoller(Roller):
-    def __init__(self, manager, owner, channel):
+
+    def _progress_skill(self):
+        '''A roll "for" a skill, against an obstacle, counts towards advancing it on the roller's sheet.
+        (sheet, skill) if this one does, (None, None) if not.'''
+        sheet = self.manager.sheets.get_loaded_sheet(self.owner) if self.manager.sheets and self.obstacle else None
+        skill = self.manager.sheets.canonical_skill(self.reason) if sheet else None
+        if not skill or not sheet.can_mark_test(skill):
+            return None, None
+        return sheet, skill
+
+
+
+class BulkRoller(OneShotRoller):
+    '''Several quick rolls at once (NPCs, weather, and the like), sent as one compact table in one message.
+    pools is a list of dicts, each with num_dice, and optionally obstacle and reason.'''
+    __slots__ = ('pools', 'rolled')
+
+    def __init__(self, manager, owner, channel, pools):
         super().__init__(manager, owner, channel)
-        
-        # Enter state hell.
-        self.has_skill = False
-        self.is_mousy = False
-        self.using_skill = False
-        self.skill_level = 0
-        self.using_nature = False
-        self.nature_level = 0
-        self.using_luck = False
-        self.tapping_nature = False
-        self.with_gear = False
-        self.helpers = 0
-        self.persona = 0
-        self.trait = 0
-        self.with_tax = False
-        self.is_wise = False
-        self.tooltip = None
-        self.tooltip_enabled = False
-        self.setting_options = True
-        self.getting_helpers = False
-
-        # These are the linear steps to building a roll. As each gets executed, they'll get popped off the list.
-        # This will have to change if I want to implement "undo" functionality, but that's a can of worms.
-        self.steps = [
-            self._ask_has_skill, 
-            self._ask_skill_level, 
-            self._ask_mousy_nature, 
-            self._ask_nature_level, 
-            self._ask_roll_strategy, 
-            self._ask_gear_bonus, 
-            self._ask_num_helpers,
-            self._ask_nature_boost,
-            self._ask_persona_bonus, 
-            self._ask_relevant_trait, 
-            self._ask_trait_help_or_hurt, 
-            self._confirm_roll,
-            self._roll_and_ask_wise, 
-            self._nudge_roll_until_done
-        ]
+        self.pools = pools
+        self.rolled = []
 
 
-    def _render_message(self, prompt, show_details=True):
-        msg = f'{self.owner.mention} is rolling dice...'
+    def is_valid(self):
+        valid = [1 <= spec['num_dice'] <= MAXIMUM_NUMBER_OF_DICE for spec in self.pools]
+        return bool(self.pools) and len(self.pools) <= MAXIMUM_NUMBER_OF_POOLS and all(valid)
 
-        if show_details:
-            msg += '```'
 
-            if self.using_luck:
-                msg += '\n------------------------------------------\n'
-            
-            if self.using_skill:
-                msg += f'Using their trained skill! +{self.skill_level}'
-            elif self.using_nature and self.is_mousy:
-                msg += f'Leaning into their mousy nature! +{self.nature_level}'
-            elif self.using_nature and not self.is_mousy:
-                msg += f'Going against their mousy nature! +{self.nature_level} (tax)'
-            elif self.using_luck:
-                msg += f'Attempting to try, and with luck, succeed! +{self.skill_level} (health or wisdom)'
-
-            if self.with_gear:
-                msg += '\nUsing the right tool for the job! +1'
-            if self.helpers > 0:
-                msg += f'\nWith some helping hands! +{self.helpers}'
-
-            if self.using_luck:
-                msg += '\n------------------------------------------'
-                msg += '\n            HALVED DUE TO LUCK\n'
-
-            if self.tapping_nature:
-                msg += f'\nTaps into their mouseness for a heroic boost! +{self.nature_level} (tax)'
-            if self.persona > 0:
-                msg += f'\nBustling with raw talent! +{self.persona}'
-
-            if self.trait > 0:
-                msg += f'\nFinding their traits to be helpful! +1'
-            elif self.trait < 0:
-                msg += f'\nFinding their traits to be harmful! -1 (gain a check)'
-
-            msg += f'\n\nTotal pool: {self._crunch(consider_luck=True)}```'
-
-        if prompt:
-            msg += f'\n>>> **{prompt}**'
+    def roll(self):
+        self.rolled = [DicePool(spec['num_dice']) for spec in self.pools]
+        for pool in self.rolled:
+            pool.roll()
 
-        return msg
 
-    
-    def _crunch(self, consider_luck=False):
-        total = 0
-        if self.using_skill:
-            total += self.skill_level
-        elif self.using_nature and self.is_mousy:
-            total += self.nature_level
-        elif self.using_nature and not self.is_mousy:
-            total += self.nature_level
-        elif self.using_luck:
-            total += self.skill_level
-        
-        if self.with_gear:
-            total += 1
+    def render(self):
+        lines = []
+        for spec, pool in zip(self.pools, self.rolled):
+            obstacle = spec.get('obstacle')
+            reason = spec.get('reason')
 
-        if self.helpers > 0:
-            total += self.helpers
+            quantity_portion = f"**{spec['num_dice']}** {'dice' if spec['num_dice'] > 1 else 'die'}"
+            reason_portion = f' for {reason}' if reason else ''
+            obstacle_portion = ''
+            if obstacle:
+                obstacle_portion = f"    **(Ob {obstacle})**  {'🎉' if pool.value() >= obstacle else '💀'}"
+            lines.append(f'{quantity_portion}{reason_portion}:  {render_dice_pool(pool)}{obstacle_portion}')
 
-        if consider_luck and self.using_luck:
-            total = int(Decimal(total / 2).to_integral_value(rounding=ROUND_HALF_UP))
+        return f'{self.owner.mention} rolls **{len(self.pools)}** pools!\n>>> ' + '\n'.join(lines)
 
-        if self.tapping_nature:
-            total += self.nature_level
 
-        if self.persona > 0:
-            total += self.persona
+    def record(self):
+        for spec, pool in zip(self.pools, self.rolled):
+            self.manager.log_pool(self.owner, self.channel, pool, obstacle=spec.get('obstacle'))
 
-        if self.trait > 0:
-            total += 1
-        elif self.trait < 0:
-            total -= 1
 
-        return total
 
+class RollMessage():
+    '''
+    A roll builder's message, kept as separate sections: header, summary, dice, prompt, and tooltip.
 
-    async def cancel(self):
-        await self.message.edit(content=f'{self.owner.mention} cancelled their roll.')
-        await self.message.clear_reactions()
-        await self.manager.uncache_roll(self)
+    Each section is only re-rendered when its inputs change, and the message is joined once per edit. So
+    toggling a tooltip, or moving on to a new prompt, reuses everything else as-is.'''
+    ORDER = ('header', 'summary', 'dice', 'prompt', 'tooltip')
+    __slots__ = ('sections', 'keys')
 
-    async def finish(self):
-        end_index = self.message.content.find('\n>>> **Nudge the result?')
+    def __init__(self, header=''):
+        self.sections = {name: '' for name in self.ORDER}
+        self.sections['header'] = header
+        self.keys = {}
 
-        if end_index == -1:
-            end_index = self.message.content.find('\n>>> **Are you wise?**')
 
-        if end_index != -1:
-            msg = self.message.content[:end_index]
-            await self.message.edit(content=msg)
-        await self.message.clear_reactions()
-        await self.manager.uncache_roll(self)
+    def set(self, name, text):
+        self.sections[name] = text
 
 
-    async def new_options(self, *args):
-        self.setting_options = True
-        await self.message.clear_reactions()
-        for emoji in args:
-            await self.message.add_reaction(emoji)
-        if self.tooltip:
-            await self.message.add_reaction('ℹ️')
-        await self.message.add_reaction('❌')
-        self.setting_options = False
+    def cached(self, name, key, render):
+        '''Set a section from render(), unless it was already rendered for these same inputs (key).'''
+        if name not in self.keys or self.keys[name] != key:
+            self.sections[name] = render()
+            self.keys[name] = key
 
 
-    async def _ask_has_skill(self, reaction):
-        await self.message.edit(content=self._render_message('Do you have the required skill?', show_details=False))
-        await self.new_options('👍', '👎')
+    def render(self):
+        return ''.join([self.sections[name] for name in self.ORDER])
 
 
-    async def _ask_skill_level(self, reaction):
-        self.has_skill = reaction.emoji == '👍'
-        prompt = 'What is your skill level?' if self.has_skill else 'What is your base attribute level?'
-        self.tooltip = 'For physical tests, this is health. Otherwise, this is wisdom.' if not self.has_skill else None
-        await self.message.edit(content=self._render_message(prompt, show_details=False))
-        options = ['1️⃣', '2️⃣', '3️⃣', '4️⃣', '5️⃣', '6️⃣']
-        await self.new_options(*options)
 
+class RollState(NamedTuple):
+    '''An immutable snapshot of a roll builder. Every answer makes a new one, so undo is just going back
+    to the previous snapshot, and a session is fully described by its state (and its dice pool).'''
+    step: str = 'has_skill'
+    has_skill: bool = False
+    skill_level: int = 0
+    is_mousy: bool = False
+    nature_level: int = 0
+    using_skill: bool = False
+    using_nature: bool = False
+    using_luck: bool = False
+    with_gear: bool = False
+    helpers: int = 0
+    tapping_nature: bool = False
+    persona: int = 0
+    trait: int = 0
+    is_wise: bool = False
 
-    async def _ask_mousy_nature(self, reaction):
-        self.skill_level = NUM_MAP[reaction.emoji]
-        self.tooltip = 'Escaping, climbing, hiding, and foraging are all "mousy" things.'
-        await self.message.edit(content=self._render_message('Is the skill of a mousy nature?', show_details=False))
-        await self.new_options('👍', '👎')
 
+class Transition(NamedTuple):
+    update: Callable        # state --> state
+    next: str               # the step to move on to
+    effect: str = None      # name of an InteractiveRoller method to run after, for things like rolling dice
 
-    async def _ask_nature_level(self, reaction):
-        self.is_mousy =  reaction.emoji == '👍'
-        await self.message.edit(content=self._render_message('What is your nature level?', show_details=False))
-        await self.new_options('1️⃣', '2️⃣', '3️⃣', '4️⃣', '5️⃣', '6️⃣', '7️⃣')
 
+class Step(NamedTuple):
+    prompt: Callable                # (state, pool) --> prompt text
+    options: Callable               # (state, pool) --> the answers on offer right now
+    answers: dict                   # emoji --> Transition
+    tooltip: Callable = None        # state --> tooltip text, or None
+    details: bool = True            # show the summary of the roll so far?
+    skippable: bool = False         # may be answered up front (from the roller's sheet), and never asked
+    tally: tuple = None             # (emoji, field) - on moving on, the field is set to how many others reacted with emoji
+    dice: str = None                # show the dice pool - 'result', or 'history'
 
-    async def _ask_roll_strategy(self, reaction):
-        self.nature_level = NUM_MAP[reaction.emoji]
-        msg = 'How would you like to roll?\n'
 
-        options = []
-        if self.has_skill:
-            options += ['🎯']
-            msg += f'\n  🎯 - Use your specified skill (+{self.skill_level} 🎲)'
-        else:
-            options += ['🍀']
-            msg += f'\n  🍀 - Use beginner\'s luck (+{self.skill_level} 🎲, pool halved ⚠️)'
-
-        if self.is_mousy:
-            msg += f'\n  🐭 - Act within your mousy nature (+{self.nature_level} 🎲)'
-            options += ['🐭']
-        elif not self.is_mousy and not self.has_skill:
-            msg += f'\n  🐭 - Act against your mousy nature (+{self.nature_level} 🎲)'
-            options += ['🐭']
-
-        skill_help = 'If you have the specified skill, using it will count towards training your skill\'s success and failure progress.'
-        luck_help = '''If you lack the skill, you can use "beginner\'s luck", which uses your base attribute in place of the required skill, \
+def _set(**fields):
+    return lambda state: state._replace(**fields)
+
+
+def _numbers(field, next_step, values):
+    return {EMOJI_MAP[n]: Transition(_set(**{field: n}), next_step) for n in values}
+
+
+def _yes_no(field, next_step):
+    return {'👍': Transition(_set(**{field: True}), next_step), '👎': Transition(_set(**{field: False}), next_step)}
+
+
+def _fixed(*options):
+    return lambda state, pool: list(options)
+
+
+def _crunch(state, consider_luck=False):
+    total = 0
+    if state.using_skill or state.using_luck:
+        total += state.skill_level
+    elif state.using_nature:
+        total += state.nature_level
+    
+    if state.with_gear:
+        total += 1
+
+    if state.helpers > 0:
+        total += state.helpers
+
+    if consider_luck and state.using_luck:
+        total = int(Decimal(total / 2).to_integral_value(rounding=ROUND_HALF_UP))
+
+    if state.tapping_nature:
+        total += state.nature_level
+
+    if state.persona > 0:
+        total += state.persona
+
+    total += state.trait
+    return total
+
+
+def _strategy_options(state, pool):
+    options = ['🎯'] if state.has_skill else ['🍀']
+    if state.is_mousy or not state.has_skill:
+        options += ['🐭']
+    return options
+
+
+def _strategy_prompt(state, pool):
+    msg = 'How would you like to roll?\n'
+    if state.has_skill:
+        msg += f'\n  🎯 - Use your specified skill (+{state.skill_level} 🎲)'
+    else:
+        msg += f'\n  🍀 - Use beginner\'s luck (+{state.skill_level} 🎲, pool halved ⚠️)'
+
+    if state.is_mousy:
+        msg += f'\n  🐭 - Act within your mousy nature (+{state.nature_level} 🎲)'
+    elif not state.has_skill:
+        msg += f'\n  🐭 - Act against your mousy nature (+{state.nature_level} 🎲)'
+    return msg
+
+
+STRATEGY_HELP = {
+    '🎯': 'If you have the specified skill, using it will count towards training your skill\'s success and failure progress.',
+    '🍀': '''If you lack the skill, you can use "beginner\'s luck", which uses your base attribute in place of the required skill, \
 at the cost of halving your dice pool (⚠️ excluding nature tapping, and persona dice). Choosing "beginner\'s luck" \
-allows you to make progress towards learning the skill properly for future use.'''
-        nature_help = '''It is also possible to use nature, instead, in some cases. Acting within your mousy nature will let you use \
+allows you to make progress towards learning the skill properly for future use.''',
+    '🐭': '''It is also possible to use nature, instead, in some cases. Acting within your mousy nature will let you use \
 your nature skill in place of the required skill, with no penalty. If you don't have the skill, you can act against your nature. \
 This will let you use your nature skill instead of beginner's luck, but at a cost (tax), and does not train the skill. Use this wisely!'''
-        
-        portions = {'🎯': skill_help, '🍀': luck_help, '🐭': nature_help}
-        includes = [portions[option] for option in options]
-        spacer = '\n\n'
-        self.tooltip = f'''This is the big decision!{spacer}{spacer.join(includes)}'''
+}
+
+
+def _strategy_tooltip(state):
+    spacer = '\n\n'
+    return f'This is the big decision!{spacer}{spacer.join([STRATEGY_HELP[_] for _ in _strategy_options(state, None)])}'
+
+
+def _nudge_options(state, pool):
+    options = ['🏁']
+    if pool.can_explode():
+        options += ['💥']
+    if state.is_wise and pool.can_reroll():
+        options += ['🔮']
+    if state.is_wise and pool.can_reroll_all():
+        options += ['🎭']
+    return options
+
+
+def _nudge_prompt(state, pool):
+    msg = 'Nudge the result?'
+    msg += '\n\n  🏁 - Finish!'
+    if pool.can_explode():
+        msg += f'\n  💥 - Re-roll all ({pool.num_can_explode()}) axes (-1 fate)!'
+    if state.is_wise and pool.can_reroll():
+        msg += '\n  🔮 - Re-roll one snake! (-1 fate)'
+    if state.is_wise and pool.can_reroll_all():
+        msg += f'\n  🎭 - Re-roll all ({pool.num_can_reroll()}) snakes! (-1 persona)'
+    return msg
+
+
+# The roll builder, as a table. Each step declares its prompt, what it offers, and where each answer leads.
+STEPS = {
+    'has_skill': Step(
+        prompt=lambda state, pool: 'Do you have the required skill?',
+        options=_fixed('👍', '👎'),
+        answers=_yes_no('has_skill', 'skill_level'),
+        details=False,
+        skippable=True),
+    'skill_level': Step(
+        prompt=lambda state, pool: 'What is your skill level?' if state.has_skill else 'What is your base attribute level?',
+        options=_fixed('1️⃣', '2️⃣', '3️⃣', '4️⃣', '5️⃣', '6️⃣'),
+        answers=_numbers('skill_level', 'mousy', range(1, 7)),
+        tooltip=lambda state: 'For physical tests, this is health. Otherwise, this is wisdom.' if not state.has_skill else None,
+        details=False,
+        skippable=True),
+    'mousy': Step(
+        prompt=lambda state, pool: 'Is the skill of a mousy nature?',
+        options=_fixed('👍', '👎'),
+        answers=_yes_no('is_mousy', 'nature_level'),
+        tooltip=lambda state: 'Escaping, climbing, hiding, and foraging are all "mousy" things.',
+        details=False),
+    'nature_level': Step(
+        prompt=lambda state, pool: 'What is your nature level?',
+        options=_fixed('1️⃣', '2️⃣', '3️⃣', '4️⃣', '5️⃣', '6️⃣', '7️⃣'),
+        answers=_numbers('nature_level', 'strategy', range(1, 8)),
+        details=False,
+        skippable=True),
+    'strategy': Step(
+        prompt=_strategy_prompt,
+        options=_strategy_options,
+        answers={
+            '🎯': Transition(_set(using_skill=True, using_nature=False, using_luck=False), 'gear'),
+            '🐭': Transition(_set(using_skill=False, using_nature=True, using_luck=False), 'gear'),
+            '🍀': Transition(_set(using_skill=False, using_nature=False, using_luck=True), 'gear')
+        },
+        tooltip=_strategy_tooltip,
+        details=False),
+    'gear': Step(
+        prompt=lambda state, pool: 'Do you have appropriate gear (+1 🎲)?',
+        options=_fixed('👍', '👎'),
+        answers=_yes_no('with_gear', 'helpers'),
+        tooltip=lambda state: 'Gear is a loose term for any tool or equipment that may help you. Lobby your GM!'),
+    'helpers': Step(
+        prompt=lambda state, pool: 'How many helpers do you have? (+1 🎲 each)',
+        options=_fixed('✋', '✅'),
+        answers={'✅': Transition(lambda state: state, 'nature_boost')},
+        tooltip=lambda state: '''Any other player may assist (except in some cases) your test with a relevant skill. Doing so, however, \
+will also potentially rope them into the consequences of failure. A mouse may offer assistance risk-free if they have a relevant wise, too.''',
+        tally=('✋', 'helpers')),
+    'nature_boost': Step(
+        prompt=lambda state, pool: f'Tap nature for a boost (-1 🎭 , -1 ⚖️ , +{state.nature_level} 🎲)?',
+        options=_fixed('👍', '👎'),
+        answers=_yes_no('tapping_nature', 'persona'),
+        tooltip=lambda state: '''Tapping nature will give you a big boost for making checks, but at a cost. Unless the test is within \
+your mousy nature, doing this will immediately tax your nature by 1. In return, you get to add a number of dice to your pool equal to \
+your nature skill. But beware! Failing the roll will further tax your nature by the margin of failure!'''),
+    'persona': Step(
+        prompt=lambda state, pool: 'Would you like to use any persona points to gain bonus dice (-1 🎭 , +1 🎲 each)?',
+        options=_fixed('0️⃣', '1️⃣', '2️⃣', '3️⃣'),
+        answers=_numbers('persona', 'trait', range(0, 4))),
+    'trait': Step(
+        prompt=lambda state, pool: 'Do you have a relevant trait?',
+        options=_fixed('👍', '👎'),
+        answers={'👍': Transition(lambda state: state, 'trait_effect'), '👎': Transition(_set(trait=0), 'confirm')}),
+    'trait_effect': Step(
+        prompt=lambda state, pool: 'Would you like that trait to help you (+1 🎲), or hamper you (-1 🎲 , +1 ☑️)?',
+        options=_fixed('😊', '😐', '😩'),
+        answers={
+            '😊': Transition(_set(trait=1), 'confirm'),
+            '😐': Transition(_set(trait=0), 'confirm'),
+            '😩': Transition(_set(trait=-1), 'confirm')
+        },
+        tooltip=lambda state: '''Checks ☑️ are really important, and are effectively your "action economy" during the open-ended \
+player turn. If you\'re likely to make the test handily, or fail no matter what, consider hampering your own roll this way for some easy checks!'''),
+    'confirm': Step(
+        prompt=lambda state, pool: 'Confirm the above looks correct. Click 🎲 when ready to roll, or ❌ to cancel.',
+        options=_fixed('🎲'),
+        answers={'🎲': Transition(lambda state: state, 'wise', effect='_roll')}),
+    'wise': Step(
+        prompt=lambda state, pool: 'Are you wise?',
+        options=_fixed('👍', '👎', '🏁'),
+        answers={
+            '👍': Transition(_set(is_wise=True), 'nudge'),
+            '👎': Transition(_set(is_wise=False), 'nudge'),
+            '🏁': Transition(lambda state: state, 'wise', effect='finish')
+        },
+        tooltip=lambda state: 'Lobby your GM for a wise\'s relevance!',
+        dice='result'),
+    'nudge': Step(
+        prompt=_nudge_prompt,
+        options=_nudge_options,
+        answers={
+            '🏁': Transition(lambda state: state, 'nudge', effect='finish'),
+            '💥': Transition(lambda state: state, 'nudge', effect='_explode'),
+            '🔮': Transition(lambda state: state, 'nudge', effect='_reroll_one'),
+            '🎭': Transition(lambda state: state, 'nudge', effect='_reroll_all')
+        },
+        tooltip=lambda state: '''Exploding axes will re-roll them for additional possible successes. Any die that lands on a six at \
+any time is eligible to be exploded. Re-rolling snakes is only possible if that particular die has not already been re-rolled, though.''',
+        dice='history')
+}
+
+# Flattened, so that moving from one state to the next is a single lookup.
+TRANSITIONS = {(name, emoji): transition for name, step in STEPS.items() for emoji, transition in step.answers.items()}
+
+
+
+class InteractiveRoller(Roller, Session):
+    '''
+    A roll builder. Walks the roller through the STEPS table, one question per step, until the dice are rolled.
+
+    The roller's answers live in an immutable RollState. Each answer looks up its transition, and swaps in
+    a new state, keeping the old one around so that ↩️ can step back to it (up until the dice hit the table).'''
+    __slots__ = ('skill', 'state', 'history', 'action', 'tooltip', 'tooltip_enabled', 'known_answers', 'rendered')
+
+    def __init__(self, manager, owner, channel, skill=None):
+        super().__init__(manager, owner, channel)
+        self.skill = skill
+        self.state = RollState()
+        self.history = []
+        self.action = ''
+        self.tooltip = None
+        self.tooltip_enabled = False
 
-        await self.message.edit(content=self._render_message(msg, show_details=False))
-        await self.new_options(*options)
+        # Answers the roller's sheet already knows. step name --> emoji answer to that step's question.
+        # Those questions are skipped, saving a round trip to discord each.
+        self.known_answers = {}
+        self._prefill_from_sheet()
 
+        skill_portion = f' for **{self.skill.title()}**' if self.skill else ''
+        self.rendered = RollMessage(f'{self.owner.mention} is rolling dice{skill_portion}...')
 
-    async def _ask_gear_bonus(self, reaction):
-        self.using_skill = reaction.emoji == '🎯' 
-        self.using_nature = reaction.emoji == '🐭'
-        self.using_luck = reaction.emoji == '🍀'
-        self.tooltip = 'Gear is a loose term for any tool or equipment that may help you. Lobby your GM!'
-        await self.message.edit(content=self._render_message('Do you have appropriate gear (+1 🎲)?'))
-        await self.new_options('👍', '👎')
 
+    async def initialize(self):
+        # The builder's message has to exist before any options (reactions) can be put on it.
+        self.message = await self.channel.send(f'{self.owner.mention}\'s roll: Initializing...')
 
-    async def _ask_num_helpers(self, reaction):
-        self.with_gear = reaction.emoji =='👍'
-        self.getting_helpers = True
-        self.tooltip = '''Any other player may assist (except in some cases) your test with a relevant skill. Doing so, however, will also \
-potentially rope them into the consequences of failure. A mouse may offer assistance risk-free if they have a relevant wise, too.'''
-        await self.message.edit(content=self._render_message('How many helpers do you have? (+1 🎲 each)'))
-        await self.new_options('✋', '✅')
 
+    @property
+    def getting_helpers(self):
+        return STEPS[self.state.step].tally is not None
 
-    async def _ask_nature_boost(self, reaction):
-        self.helpers = next(_.count - 1 for _ in reaction.message.reactions if _.emoji == '✋')
-        self.getting_helpers = False
-        self.tooltip = '''Tapping nature will give you a big boost for making checks, but at a cost. Unless the test is within your mousy \
-nature, doing this will immediately tax your nature by 1. In return, you get to add a number of dice to your pool equal to your nature skill. \
-But beware! Failing the roll will further tax your nature by the margin of failure!'''
-        await self.message.edit(content=self._render_message(f'Tap nature for a boost (-1 🎭 , -1 ⚖️ , +{self.nature_level} 🎲)?'))
-        await self.new_options('👍', '👎')
 
+    def _prefill_from_sheet(self):
+        '''If the roller's sheet is already cached, answer what it can. This never pulls the sheet.'''
+        sheet = self.manager.sheets.get_loaded_sheet(self.owner) if self.manager.sheets else None
+        if not sheet or not self.skill or not sheet.check_valid_skill(self.skill):
+            return
 
-    async def _ask_persona_bonus(self, reaction):
-        self.tapping_nature = reaction.emoji == '👍'
-        await self.message.edit(content=self._render_message('Would you like to use any persona points to gain bonus dice (-1 🎭 , +1 🎲 each)?'))
-        await self.new_options('0️⃣', '1️⃣', '2️⃣', '3️⃣')
+        rating = sheet.get_rating(self.skill)
+        has_skill = isinstance(rating, int) and rating > 0
+        self.known_answers['has_skill'] = '👍' if has_skill else '👎'
+        if has_skill and 1 <= rating <= 6:
+            self.known_answers['skill_level'] = EMOJI_MAP[rating]
 
+        nature = sheet.get_rating('nature')
+        if isinstance(nature, int) and 1 <= nature <= 7:
+            self.known_answers['nature_level'] = EMOJI_MAP[nature]
 
-    async def _ask_relevant_trait(self, reaction):
-        self.persona = NUM_MAP[reaction.emoji]
-        await self.message.edit(content=self._render_message('Do you have a relevant trait?'))
-        await self.new_options('👍', '👎')
+
+    def _render_message(self, prompt, show_details=True):
+        '''Renders the message for a new step. Only the prompt is guaranteed to be new.'''
+        if show_details:
+            self.rendered.cached('summary', self.state._replace(step=None), self._render_summary)
+        else:
+            self.rendered.cached('summary', None, str)
+        self.rendered.set('prompt', f'\n>>> **{prompt}**' if prompt else '')
+        self.rendered.set('tooltip', '')
+        return self.rendered.render()
 
 
-    async def _ask_trait_help_or_hurt(self, reaction):
-        has_trait = reaction.emoji =='👍'
+    def _render_dice(self, key, render, prompt):
+        '''Renders the message for a step that shows dice, below the summary. The dice section is only
+        re-rendered when the pool has changed (key).'''
+        self._render_message(None)
+        self.rendered.cached('dice', key, render)
+        self.rendered.set('prompt', f'\n\n>>> **{prompt}**')
+        return self.rendered.render()
 
-        # if no trait, skip the next question, and feed neutral as the response
-        if not has_trait:
-            self.steps.pop(0)
-            reaction.emoji = '😐'
-            self.tooltip = None
-            self.tooltip_enabled = False
-            return await self._confirm_roll(reaction)
 
-        self.tooltip = '''Checks ☑️ are really important, and are effectively your "action economy" during the open-ended player turn. If you\'re 
-likely to make the test handily, or fail no matter what, consider hampering your own roll this way for some easy checks!'''
-        await self.message.edit(content=self._render_message('Would you like that trait to help you (+1 🎲), or hamper you (-1 🎲 , +1 ☑️)?'))
-        await self.new_options('😊', '😐', '😩')
+    def _render_summary(self):
+        state = self.state
+        msg = '```'
 
+        if state.using_luck:
+            msg += '\n------------------------------------------\n'
+        
+        if state.using_skill:
+            msg += f'Using their trained skill! +{state.skill_level}'
+        elif state.using_nature and state.is_mousy:
+            msg += f'Leaning into their mousy nature! +{state.nature_level}'
+        elif state.using_nature and not state.is_mousy:
+            msg += f'Going against their mousy nature! +{state.nature_level} (tax)'
+        elif state.using_luck:
+            msg += f'Attempting to try, and with luck, succeed! +{state.skill_level} (health or wisdom)'
+
+        if state.with_gear:
+            msg += '\nUsing the right tool for the job! +1'
+        if state.helpers > 0:
+            msg += f'\nWith some helping hands! +{state.helpers}'
+
+        if state.using_luck:
+            msg += '\n------------------------------------------'
+            msg += '\n            HALVED DUE TO LUCK\n'
+
+        if state.tapping_nature:
+            msg += f'\nTaps into their mouseness for a heroic boost! +{state.nature_level} (tax)'
+        if state.persona > 0:
+            msg += f'\nBustling with raw talent! +{state.persona}'
+
+        if state.trait > 0:
+            msg += f'\nFinding their traits to be helpful! +1'
+        elif state.trait < 0:
+            msg += f'\nFinding their traits to be harmful! -1 (gain a check)'
+
+        msg += f'\n\nTotal pool: {_crunch(state, consider_luck=True)}```'
+        return msg
 
-    async def _confirm_roll(self, reaction):
-        if reaction.emoji == '😊':
-            self.trait = 1
-        elif reaction.emoji == '😐':
-            self.trait = 0
-        elif reaction.emoji == '😩':
-            self.trait = -1
 
-        await self.message.edit(content=self._render_message('Confirm the above looks correct. Click 🎲 when ready to roll, or ❌ to cancel.'))
-        await self.new_options('🎲')
+    async def cancel(self):
+        await self._close(f'{self.owner.mention} cancelled their roll.')
+        await self.manager.uncache_roll(self)
+
+
+    async def expire(self):
+        # Once the dice are down, the roll stands
+        if self.pool.size():
+            return await self.finish()
+        await self._close(f'{self.owner.mention}\'s roll expired - I\'m restarting. Start it again in a moment.')
+        await self.manager.uncache_roll(self)
+
+
+    async def finish(self):
+        # Drop the prompt (and any tooltip), leaving the summary and dice as the final result.
+        if self.rendered.sections['prompt'] or self.manager.use_buttons:
+            self.rendered.set('prompt', '')
+            self.rendered.set('tooltip', '')
+            await self._close(self.rendered.render())
+        else:
+            await self.message.clear_reactions()
+        await self.manager.uncache_roll(self)
+        self._record_tax()
+        if self.pool.size():
+            self.manager.log_roll(self)
+            # Built for a versus test? Then this is the owner's pool for it.
+            await self.manager.submit_versus(self.owner, self.channel, pool=self.pool)
 
 
-    async def _roll_and_ask_wise(self, reaction):
-        self.pool.add_dice(self._crunch(consider_luck=True))
+    def _record_tax(self):
+        '''Acting against nature, or tapping it outside of it, taxes nature on the roller's sheet.'''
+        sheet = self.manager.sheets.get_loaded_sheet(self.owner) if self.manager.sheets else None
+        if not sheet or not self.pool.size() or self.state.is_mousy:
+            return
+        tax = int(self.state.tapping_nature) + int(self.state.using_nature)
+        if tax:
+            sheet.tax_nature(tax)
+
+
+    async def _roll(self):
+        self.pool.add_dice(_crunch(self.state, consider_luck=True))
         self.pool.roll()
+        # The dice have hit the table. No taking it back now.
+        self.history = []
+
+
+    async def _explode(self):
+        self.action = f'\n\n{self.owner.mention} rolls a new die for each axe ({self.pool.num_can_explode()})!'
+        self.pool.explode()
+
 
-        msg = f'''{self._render_message(None)}\n{self.owner.mention} rolls the dice!\n{render_dice_pool(self.pool)}\n\n>>> **Are you wise?**'''
+    async def _reroll_one(self):
+        self.action = f'\n\n{self.owner.mention} re-rolls a snake!'
+        self.pool.reroll_one()
 
-        self.tooltip = 'Lobby your GM for a wise\'s relevance!'
-        await self.message.edit(content=msg)
-        await self.new_options('👍', '👎', '🏁')
 
+    async def _reroll_all(self):
+        self.action = f'\n\n{self.owner.mention} re-rolls all snakes ({self.pool.num_can_reroll()})!'
+        self.pool.reroll_all()
 
-    async def _nudge_roll_until_done(self, reaction):
-        if reaction and reaction.emoji == '🏁':
-            await self.finish()
+
+    def _controls(self):
+        '''The options offered on every step, after the step's own.'''
+        return (['ℹ️'] if self.tooltip else []) + (['↩️'] if self.history else []) + ['❌']
+
+
+    async def new_options(self, *args):
+        self.options = set(args) | {'ℹ️', '↩️', '❌'}
+        self.tally.clear()
+        await self.message.clear_reactions()
+        for emoji in list(args) + self._controls():
+            await self.message.add_reaction(emoji)
+
+
+    async def _present(self, content, options):
+        '''Puts a prompt up, with its options. As buttons, that's the one edit.'''
+        if not self.manager.use_buttons:
+            await self.message.edit(content=content)
+            return await self.new_options(*options)
+        self.options = set(options) | {'ℹ️', '↩️', '❌'}
+        self.tally.clear()
+        await self._edit(content, SessionView(self, buttons=list(options) + self._controls()))
+
+
+    async def react(self, user_id, emoji, added=True):
+        # Keep the session's own tally current, so nothing needs the message to be in the client cache.
+        self.tally.update(emoji, user_id, added)
+        if not added:
             return
 
-        if not self.is_wise:
-            self.is_wise = reaction.emoji == '👍'
-        
-        exploded = reaction.emoji == '💥'
-        reroll_one = reaction.emoji == '🔮'
-        reroll_all = reaction.emoji == '🎭'
-        
-        msg = self._render_message(None)
-        msg += f'\n{self.owner.mention} rolls the dice!'
-
-        if exploded:
-            msg += f'\n\n{self.owner.mention} rolls a new die for each axe ({self.pool.num_can_explode()})!'
-            self.pool.explode()
-        elif reroll_one:
-            msg += f'\n\n{self.owner.mention} re-rolls a snake!'
-            self.pool.reroll_one()
-        elif reroll_all:
-            msg += f'\n\n{self.owner.mention} re-rolls all snakes ({self.pool.num_can_reroll()})!'
-            self.pool.reroll_all()
-        
-        msg += f'\n\n{render_dice_pool(self.pool, with_history=True)}'
-        msg += '\n\n>>> **Nudge the result?'
-        msg += '\n\n  🏁 - Finish!'
-        
-        options = ['🏁']
-        if self.pool.can_explode():
-            msg += f'\n  💥 - Re-roll all ({self.pool.num_can_explode()}) axes (-1 fate)!'
-            options += ['💥']
-        if self.is_wise and self.pool.can_reroll():
-            msg += '\n  🔮 - Re-roll one snake! (-1 fate)'
-            options += ['🔮']
-        if self.is_wise and self.pool.can_reroll_all():
-            msg += f'\n  🎭 - Re-roll all ({self.pool.num_can_reroll()}) snakes! (-1 persona)'
-            options += ['🎭']
-        msg += '**'
-
-        self.tooltip = '''Exploding axes will re-roll them for additional possible successes. Any die that lands on a six at any \
-time is eligible to be exploded. Re-rolling snakes is only possible if that particular die has not already been re-rolled, though.'''
-        
-        await self.message.edit(content=msg)
-        await self.new_options(*options)
+        # Exception - other players can offer help for that one step
+        if self.getting_helpers:
+            if emoji == '✋' and self.owner.id != user_id:
+                return
+            elif emoji == '✋' and self.owner.id == user_id:
+                return await self.remove_reaction(emoji, user_id)
+
+        # If the reaction is from the owner, and a valid option, interpet it. Otherwise, purge.
+        if self.owner.id == user_id and emoji in self.options:
+            await self.next(emoji=emoji)
+        else:
+            await self.remove_reaction(emoji, user_id)
+
+
+    async def choose(self, interaction, emoji):
+        '''A button click. Same rules as reactions - only the owner answers, but others can offer a hand.'''
+        user_id = interaction.user.id
+        if self.getting_helpers and emoji == '✋':
+            if user_id == self.owner.id:
+                return await interaction.response.send_message('You can\'t help yourself!', ephemeral=True)
+            # The button keeps count. Relabelling it doubles as the acknowledgement.
+            self.tally.toggle(emoji, user_id)
+            helpers = self.tally.count(emoji, exclude=(self.owner.id,))
+            self.view.buttons[emoji].label = str(helpers) if helpers else None
+            return await interaction.response.edit_message(view=self.view)
+
+        if user_id != self.owner.id:
+            return await interaction.response.send_message('That\'s not your roll!', ephemeral=True)
+        await interaction.response.defer()
+        if emoji in self.options:
+            await self.next(emoji=emoji)
+
+
+    async def _show(self):
+        '''Puts the current step's question up, and offers its answers.'''
+        step = STEPS[self.state.step]
+        self.tooltip = step.tooltip(self.state) if step.tooltip else None
+        self.tooltip_enabled = False
+        prompt = step.prompt(self.state, self.pool)
+
+        if step.dice == 'result':
+            content = self._render_dice(len(self.pool.get_history()),
+                                        lambda: f'\n{self.owner.mention} rolls the dice!\n{render_dice_pool(self.pool)}', prompt)
+        elif step.dice == 'history':
+            content = self._render_dice((len(self.pool.get_history()), 'history'),
+                                        lambda: f'\n{self.owner.mention} rolls the dice!{self.action}\n\n{render_dice_pool(self.pool, with_history=True)}',
+                                        prompt)
+        else:
+            content = self._render_message(prompt, show_details=step.details)
+
+        await self._present(content, step.options(self.state, self.pool))
+
+
+    async def _advance(self, transition):
+        '''Moves to the next state, then on through any steps that have already been answered.'''
+        step = STEPS[self.state.step]
+        if not self.pool.size():
+            self.history.append(self.state)
+        state = self.state
+        if step.tally:
+            emoji, field = step.tally
+            state = state._replace(**{field: self.tally.count(emoji, exclude=(self.owner.id,))})
+        self.state = transition.update(state)._replace(step=transition.next)
 
+        self.action = ''
+        if transition.effect == 'finish':
+            return await self.finish()
+        if transition.effect:
+            await getattr(self, transition.effect)()
 
-    async def next(self, reaction=None):
+        self._skip_known()
+        await self._show()
+
+
+    def _skip_known(self):
+        '''Answers any steps the sheet already knows the answer to, without asking.'''
+        while STEPS[self.state.step].skippable and self.state.step in self.known_answers:
+            transition = TRANSITIONS[(self.state.step, self.known_answers[self.state.step])]
+            self.state = transition.update(self.state)._replace(step=transition.next)
+
+
+    async def next(self, emoji=None):
         # Lock prevents responses from interrupting previous runs while finishing
         # work, like loading emoji options for a particular question.
         async with self.lock:
-            # Assess the response to the previous prompt.
             # Cancel button - close out the builder.
-            if reaction and reaction.emoji == '❌':
+            if emoji == '❌':
                 await self.cancel()
                 return
 
-            # Finish button - Finalize the builder.
-            if reaction and reaction.emoji == '🏁':
-                await self.finish()
-                return
-
             # Tooltip button - Show the tooltip portion in the message.
-            if reaction and reaction.emoji == 'ℹ️':
-                if not self.tooltip_enabled:
+            if emoji == 'ℹ️':
+                if not self.tooltip_enabled and self.tooltip:
                     self.tooltip_enabled = True
-                    content_with_tooltip = self.message.content + f'\n\nℹ️ *{self.tooltip}*\n'
-                    await self.message.edit(content=content_with_tooltip)
+                    self.rendered.set('tooltip', f'\n\nℹ️ *{self.tooltip}*\n')
+                    await self.message.edit(content=self.rendered.render())
                 return
 
-            # Reset the tooltip state, in case this is a new step.
-            self.tooltip = None
-            self.tooltip_enabled = False
-            # Pass along the reaction response from the previous question.
-            await self.steps[0](reaction)
-            
-            # Progress the state of the question flow, until the final state.
-            if len(self.steps) > 1:
-                self.steps.pop(0)
+            # Undo button - back to the previous snapshot.
+            if emoji == '↩️':
+                if self.history:
+                    self.state = self.history.pop()
+                    await self._show()
+                return
+
+            # First step. Nothing to answer yet, other than what the sheet already knows.
+            if emoji is None:
+                self._skip_known()
+                await self._show()
+                return
 
+            transition = TRANSITIONS.get((self.state.step, emoji))
+            if transition:
+                await self._advance(transition)
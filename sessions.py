@@ -0,0 +1,118 @@
+import asyncio
+from abc import ABC, abstractmethod
+
+import discord
+
+
+class Session(ABC):
+    '''
+    An open message that a player answers, one step at a time - a roll builder, or a profile selector.
+
+    Answers come in as reactions (react) or as button clicks (choose), depending on the UI in use. Either
+    way, the session decides who may answer, and what to make of it. Each step runs under the session's
+    lock.
+
+    Sessions have a manager (with use_buttons, for which UI), a message, and the view currently on it.'''
+    __slots__ = ()
+
+    @abstractmethod
+    async def react(self, user_id, emoji, added=True):
+        '''A reaction added to (or taken off) the session's message.'''
+        pass
+
+
+    @abstractmethod
+    async def choose(self, interaction, value):
+        '''A click on one of the session's components. Must respond to the interaction.'''
+        pass
+
+
+    @abstractmethod
+    async def cancel(self):
+        pass
+
+
+    @abstractmethod
+    async def expire(self):
+        '''Closes the session out for good, when the bot's going away. Takes its options off the message.'''
+        pass
+
+
+    async def _edit(self, content, view):
+        '''One edit for the message and its components. A view of None takes them off.'''
+        if self.view:
+            self.view.stop()
+        self.view = view
+        self.message = await self.message.edit(content=content, view=view)
+
+
+    async def _close(self, content):
+        '''Final edit. Takes the options off the message, whichever kind they are.'''
+        if self.manager.use_buttons:
+            await self._edit(content, None)
+        else:
+            await self.message.edit(content=content)
+            await self.message.clear_reactions()
+
+
+    async def remove_reaction(self, emoji, user_id):
+        await self.message.remove_reaction(emoji, discord.Object(id=user_id))
+
+
+
+class SessionRegistry():
+    '''
+    Every open session, by its message's id. The one place reaction events are routed from, so each goes
+    straight to the session it's for (or nowhere - most messages the bot has sent aren't open sessions),
+    with a single lookup.'''
+    def __init__(self):
+        self.sessions = {}
+
+
+    def __len__(self):
+        return len(self.sessions)
+
+
+    def register(self, session):
+        self.sessions[session.message.id] = session
+
+
+    def unregister(self, session):
+        # Only if it's still the one registered
+        if self.sessions.get(session.message.id) is session:
+            del self.sessions[session.message.id]
+
+
+    def get(self, message_id):
+        return self.sessions.get(message_id)
+
+
+    async def dispatch(self, message_id, user_id, emoji, added=True):
+        session = self.sessions.get(message_id)
+        if session:
+            await session.react(user_id, emoji, added)
+
+
+    async def expire_all(self, timeout):
+        '''Expires every open session, all at once. Each gets up to timeout to finish the step it's on.'''
+        sessions = list(self.sessions.values())
+        await asyncio.gather(*[self._expire(session, timeout) for session in sessions])
+        return len(sessions)
+
+
+    async def _expire(self, session, timeout):
+        try:
+            await asyncio.wait_for(session.lock.acquire(), timeout)
+            locked = True
+        except asyncio.TimeoutError:
+            locked = False
+        try:
+            # The step it was on may have closed it out
+            if self.sessions.get(session.message.id) is session:
+                await session.expire()
+        except Exception as e:
+            print(f'Failed to expire session on message {session.message.id}: {e}')
+        finally:
+            self.unregister(session)
+            if locked:
+                session.lock.release()
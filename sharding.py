@@ -0,0 +1,31 @@
+def partition_key(channel):
+    '''Session state is keyed by guild, then channel. A partition never spans shards.'''
+    guild = getattr(channel, 'guild', None)
+    return f'{guild.id if guild else 0}_{channel.id}'
+
+
+class ShardRouter():
+    '''
+    Decides which shard owns which sessions.
+
+    Discord delivers every event for a guild, reactions included, to shard (guild_id >> 22) % shard_count,
+    and everything outside of a guild (DMs) to shard 0. Roll builders and profile selectors are only ever
+    created by the shard that owns the channel they're in, so the reactions that drive them always land
+    in the process that holds them. Anything that shows up for a guild this process doesn't own is dropped,
+    rather than spawning a session that no reaction could ever reach.
+
+    With a single unsharded client, this owns everything, and is a no-op.'''
+    def __init__(self, shard_count=None, shard_ids=None):
+        self.shard_count = shard_count or 1
+        self.shard_ids = set(shard_ids) if shard_ids is not None else set(range(self.shard_count))
+
+
+    def shard_for(self, guild_id):
+        if guild_id is None:
+            return 0
+        return (guild_id >> 22) % self.shard_count
+
+
+    def owns(self, guild_id):
+        return self.shard_for(guild_id) in self.shard_ids
+
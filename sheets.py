@@ -1,20 +1,55 @@
 import asyncio
 import functools 
+import json
+import os
 import textwrap
-
-import pygsheets
-from asgiref.sync import sync_to_async
+import time
+import zlib
+from abc import ABC, abstractmethod
+from typing import NamedTuple
 
 from cells import sheet_index
+from gsheets import SheetsClient, SheetsError
+from localsheets import is_local_sheet, load_grid, resolve_path, write_cells
+from quota import TokenBucket
+from sessions import Session, SessionRegistry
+from sharding import partition_key
+from skills import SkillLookup
+from util import SessionView
 
 
 CHARACTER_INDEX = sheet_index['character']
+CHARACTER_SHEET_TITLE = 'Character Sheet'
+
+# What google says (with a 400) when a range names a tab that isn't there. The cached tab title is stale -
+# the tab's been renamed, or deleted, since it was looked up.
+STALE_TAB_ERROR = 'Unable to parse range'
 
 PROFILE_LIMIT = 5
 
+# Progress writes are held this long, so ticks from rolls in quick succession go out in one batch.
+WRITE_DEBOUNCE_SECONDS = 5
+
+# A pulled sheet is trusted this long before a command pulls it again.
+PULL_TTL_SECONDS = 60
+
+# Players using commands get their sheet refreshed in the background, so their next one doesn't wait on a
+# pull - but only this often per player, and only this many a minute all told. That keeps most of google's
+# read quota for commands. Past either limit, the refresh is skipped, and a command pulls as usual.
+BACKGROUND_REFRESH_SECONDS = 10 * 60
+BACKGROUND_REFRESHES_PER_MINUTE = 10
+BACKGROUND_REFRESH_BURST = 3
+
+# Parsed sheets are kept in the database between runs, in this format. Bump it if the layout changes.
+SNAPSHOT_VERSION = 1
 
-# Necessary permissions to interact with google sheets.
-SCOPES = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
+# Warming the cache at startup: this many pulls at once, each started this long after the one before.
+PREFETCH_CONCURRENCY = 4
+PREFETCH_STAGGER_SECONDS = 0.25
+
+# Short names for the base stats in the !party summary, and how many top skills it lists per character.
+BASE_STAT_ABBREVIATIONS = ['NAT', 'HEA', 'WIL', 'CIR', 'RES']
+PARTY_TOP_SKILLS = 3
 
 BASE_STATS = ['nature', 'health', 'will', 'circles', 'resources']
 SKILL_LIST = ['administrator', 'apiarist', 'archivist', 'armorer', 'baker', 'boatcrafter',
@@ -25,6 +60,92 @@ SKILL_LIST = ['administrator', 'apiarist', 'archivist', 'armorer', 'baker', 'boa
                 'survivalist', 'weather watcher', 'weaver']
 PROGRESSIONS = BASE_STATS + SKILL_LIST
 
+# Every progression has a fixed slot. A sheet keeps its skills as a list of records in this order,
+# rather than a dict of dicts, one per skill.
+SKILL_INDEX = {name: i for i, name in enumerate(PROGRESSIONS)}
+
+# Whatever a player (or a sheet) calls a skill --> its name, as above
+SKILLS = SkillLookup(PROGRESSIONS)
+
+
+class Progress(NamedTuple):
+    rating: object = None
+    success: int = 0
+    fail: int = 0
+
+
+class Wise(NamedTuple):
+    name: str
+    passed: bool
+    failed: bool
+    fate: bool
+    persona: bool
+
+
+class Trait(NamedTuple):
+    name: str
+    level: object
+    uses: tuple
+    # Position in the sheet's trait rows, for finding the use boxes' cells again
+    slot: int
+
+
+EMPTY_PROGRESS = Progress()
+
+
+
+class MissingTabError(SheetsError):
+    '''A spreadsheet with no character tab - renamed, or deleted. Not google's trouble, so never transient.'''
+    def __init__(self, key):
+        super().__init__(None, f'No "{CHARACTER_SHEET_TITLE}" tab in sheet {key}')
+
+
+    @property
+    def transient(self):
+        return False
+
+
+
+class LocalSheetError(SheetsError):
+    '''A sheet file that's missing, or can't be read or written. There's no HTTP status, and trying again
+    won't help, so it never goes down google's retry or stale tab paths.'''
+    def __init__(self, message):
+        super().__init__(None, message)
+
+
+    @property
+    def transient(self):
+        return False
+
+
+
+def a1_range(tab, cell=None):
+    '''An A1 range on a tab. The whole tab, if no cell is given.'''
+    return f"'{tab}'!{cell}" if cell else f"'{tab}'"
+
+
+@functools.lru_cache(maxsize=1024)
+def render_rating(skill, rating, success, fail):
+    '''One line of the skills table. Pure, so the same progress never renders twice.'''
+    if not rating:
+        return
+    use_luck = rating == 'x' or rating == '0'
+
+    success_fill = min(success, 9)
+    success_empty = rating - success if not use_luck else 6 - success
+    success_empty = min(success_empty, 9 - success_fill)
+
+    fail_fill = fail if not use_luck else 0
+    fail_fill = min(fail_fill, 8)
+    fail_empty = rating - fail - 1 if not use_luck else 0
+    fail_empty = min(fail_empty, 8 - fail_fill)
+
+    skill_portion = f"{(skill.title() + ':').ljust(17)}{(str(rating) if not use_luck else '*').rjust(2)}    "
+    success_portion = f"{'▪'*success_fill + '▫'*success_empty}"
+    fail_portion = f"{'▪'*fail_fill + '▫'*fail_empty}"
+    progress_portion = f"{success_portion.ljust(9)}   {fail_portion.ljust(8)}   "
+    return f"{skill_portion}{progress_portion}"
+
 
 def with_profile(fn):
     '''This decorator does a few things.
@@ -33,14 +154,16 @@ def with_profile(fn):
     last used profile, if one exists. If no profile can be loaded, it will send a message back to the
     channel instructing the user to register a profile before using the command.
 
-    The sheet associated with the profile will pull its data, and be sent to the wrapped function.
+    The sheet associated with the profile will pull its data (unless it's fresh), and be sent to the
+    wrapped function.
 
     This is only meant to decorate SheetManager methods that require an active sheets profile.
     Requires user and channel as first two positions args of the wrapped function.'''
     from functools import wraps
     @wraps(fn)
     async def wrapper(self, user, channel, *args, **kwargs):
-        if user.id not in self.sheets_cache:
+        # With a shared profile store, another shard may have changed the current profile under us.
+        if user.id not in self.sheets_cache or self.db_manager.shared:
             key = await self.db_manager.get_current(user)
             if key:
                 await self.use_profile(user, key)
@@ -49,18 +172,45 @@ def with_profile(fn):
         if user.id not in self.sheets_cache:
             return await channel.send(f'{user.mention} - No profile selected. Select with `!profile select`.')
         sheet = self.sheets_cache[user.id]
-        await sheet.pull()
+        if not sheet.is_fresh():
+            try:
+                await sheet.pull()
+            except SheetsError as e:
+                # While google's having trouble, the last good pull is better than nothing
+                if not e.transient or not sheet.loaded:
+                    print(f'Failed to pull sheet {sheet.key}: {e}')
+                    if isinstance(e, MissingTabError):
+                        return await channel.send(f'{user.mention} - Your sheet has no "{CHARACTER_SHEET_TITLE}" tab. '
+                                                  'Was it renamed? Name it back, and try again.')
+                    return await channel.send(f'{user.mention} - Couldn\'t reach your sheet just now. Try again in a bit.')
         return await fn(self, user, channel, sheet=sheet, *args, **kwargs)
     return wrapper
 
 
 
 class SheetManager():
-    def __init__(self, creds_path, db_manager):
+    def __init__(self, creds_path, db_manager, sheets_api_url=None, local_sheets_dir=None, drive_api_url=None,
+                 use_buttons=False, sessions=None):
         self.creds_path = creds_path
+        # Profile selectors offer a select menu, rather than reactions
+        self.use_buttons = use_buttons
+        self.client = SheetsClient(creds_path, sheets_api_url, drive_url=drive_api_url)
+        # Sheet files can only be registered from under here. No local sheets at all, if unset.
+        self.local_sheets_dir = local_sheets_dir
+        # spreadsheet key --> title of its character tab
+        self.tab_titles = {}
+        # user ids with a background pull in flight, and those whose current profile has been looked up
+        self.prefetching = set()
+        self.looked_up = set()
+        # user id --> when their sheet was last refreshed in the background, and the cap on all of those
+        self.refreshed_at = {}
+        self.background_refreshes = TokenBucket(BACKGROUND_REFRESHES_PER_MINUTE / 60, BACKGROUND_REFRESH_BURST)
+        # channel id --> ids of users who've spoken there since startup
+        self.active_by_channel = {}
         self.db_manager = db_manager
         self.sheets_cache = {}
-        self.profile_selector_cache_by_message = {}
+        # Open profile selectors. By message, in the registry shared with the roller, and by request here.
+        self.sessions = sessions if sessions is not None else SessionRegistry()
         self.profile_selector_cache_by_request = {}
         self.lock = asyncio.Lock()
 
@@ -68,45 +218,94 @@ class SheetManager():
     async def initialize(self):
         async with self.lock:
             # Just test the authentication to google services via service account
+            if not self.creds_path:
+                return
             print("  Authenticating to google web services...")
-            await self.get_gc()
+            await self.client.authenticate()
             print("  Done.")
 
 
     def _generate_request_key(self, user, channel):
-        return str(user.id) + "_" + str(channel.id)
+        return partition_key(channel) + "_" + str(user.id)
 
 
     async def uncache_profile_selector(self, profile_selector):
         async with self.lock:
-            key = self._generate_request_key(profile_selector.owner, profile_selector.message)
-            del self.profile_selector_cache_by_message[profile_selector.message.id]
+            key = self._generate_request_key(profile_selector.owner, profile_selector.channel)
+            self.sessions.unregister(profile_selector)
             del self.profile_selector_cache_by_request[key]
 
 
     async def cache_profile_selector(self, profile_selector):
         async with self.lock:
-            key = self._generate_request_key(profile_selector.owner, profile_selector.message)
-            self.profile_selector_cache_by_message[profile_selector.message.id] = profile_selector
+            key = self._generate_request_key(profile_selector.owner, profile_selector.channel)
+            self.sessions.register(profile_selector)
             self.profile_selector_cache_by_request[key] = profile_selector
     
 
-    async def get_gc(self):
-        return await sync_to_async(pygsheets.authorize)(service_file=self.creds_path)
+    async def close(self):
+        await self.client.close()
+
+
+    async def flush_all(self):
+        '''Pushes every sheet's pending writes right away, instead of after the debounce. Returns how many
+        sheets still have writes pending after (google being degraded, say).'''
+        sheets = [_ for _ in {id(_): _ for _ in self.sheets_cache.values()}.values() if _.pending_writes]
+        for sheet in sheets:
+            if sheet.flush_task:
+                sheet.flush_task.cancel()
+                sheet.flush_task = None
+        await asyncio.gather(*[sheet.flush() for sheet in sheets])
+        for sheet in sheets:
+            # No retrying later. There is no later.
+            if sheet.flush_task:
+                sheet.flush_task.cancel()
+                sheet.flush_task = None
+        return len([_ for _ in sheets if _.pending_writes])
+
+
+    async def health(self):
+        '''Health check. Never calls google - the quota is better spent on sheets.'''
+        if self.client.governor.breaker.is_open():
+            raise RuntimeError(f'google is degraded, backing off ({len(self.sheets_cache)} sheets cached)')
+        return f'{len(self.sheets_cache)} sheets cached'
+
+
+    async def resolve_tab(self, key):
+        '''The title of a spreadsheet's character tab. Looked up once per spreadsheet, and kept until a call
+        against it fails. A sheet with no "Character Sheet" tab (renamed, say) is an error - reading, or worse,
+        writing progress to whatever other tab it has would be no good.'''
+        if key not in self.tab_titles:
+            titles = [tab['title'] for tab in await self.client.get_sheet_properties(key)]
+            if CHARACTER_SHEET_TITLE not in titles:
+                raise MissingTabError(key)
+            self.tab_titles[key] = CHARACTER_SHEET_TITLE
+        return self.tab_titles[key]
+
+
+    async def on_tab(self, key, call):
+        '''Awaits call(tab title) for a spreadsheet. If it fails because the tab isn't there (anymore), the
+        tab is resolved again, and the call retried once.'''
+        try:
+            return await call(await self.resolve_tab(key))
+        except SheetsError as e:
+            if e.status != 400 or STALE_TAB_ERROR not in e.message or key not in self.tab_titles:
+                raise
+            del self.tab_titles[key]
+            return await call(await self.resolve_tab(key))
+
+
+    def sheet_for_key(self, key):
+        '''Profiles are either a google sheets key, or the path to a sheet file under local_sheets_dir.'''
+        return LocalSheet(self, key) if is_local_sheet(key) else GoogleBackedSheet(self, key)
 
 
-    async def handle_event(self, user, reaction):
-        # If not a "roll" message, bail
-        if reaction.message.id in self.profile_selector_cache_by_message:
-            # If the reaction is from the owner, and a valid option, interpet it. Otherwise, purge.
-            profile_selector = self.profile_selector_cache_by_message[reaction.message.id]
-            if profile_selector.owner.id == user.id and reaction.count > 1:
-                await profile_selector.select(reaction=reaction)
-            else:
-                await reaction.remove(user)
-        
-    
     async def register_profile(self, channel, user, key):
+        if is_local_sheet(key):
+            path = resolve_path(self.local_sheets_dir, key)
+            if not path or not os.path.isfile(path):
+                place = 'in the local sheets folder' if self.local_sheets_dir else 'here - local sheets aren\'t enabled'
+                return await channel.send(f'{user.mention} - No sheet file `{key}` {place}.')
         was_added = await self.db_manager.add_profile(user, key)
         msg = 'Profile registered' if was_added else 'A profile already exists with that key'
         await channel.send(f'{user.mention} - {msg}.')
@@ -119,11 +318,111 @@ class SheetManager():
 
 
     async def use_profile(self, user, key):
-        sheet = self.sheets_cache[user.id] if user.id in self.sheets_cache else GoogleBackedSheet(self, key)
-        await self.db_manager.update_current(user, key)
+        sheet = self.sheets_cache.get(user.id)
+        if not sheet or sheet.key != key:
+            sheet = self.sheet_for_key(key)
+            await self.db_manager.update_current(user, key)
         self.sheets_cache[user.id] = sheet
 
 
+    async def prefetch_all(self):
+        '''Warm the cache with every player's current sheet, so their first command doesn't wait on a pull.
+        A few pulls run at a time, staggered, so startup doesn't burst through the quota.'''
+        rows = await self.db_manager.get_all_current()
+        semaphore = asyncio.Semaphore(PREFETCH_CONCURRENCY)
+
+        async def prefetch(delay, user_id, key):
+            await asyncio.sleep(delay)
+            async with semaphore:
+                await self._prefetch(user_id, key)
+
+        # Snapshots go in right away. Then everything is revalidated, a few at a time.
+        snapshots = {row['sheets_key']: row for row in await self.db_manager.get_sheet_snapshots()}
+        restored = 0
+        for row in rows:
+            if row['user_id'] not in self.sheets_cache and row['sheets_key'] in snapshots:
+                sheet = self.sheet_for_key(row['sheets_key'])
+                if self.restore_snapshot(sheet, snapshots[row['sheets_key']]):
+                    self.sheets_cache[row['user_id']] = sheet
+                    restored += 1
+        print(f'  Restored {restored} sheets from snapshots.')
+
+        self.looked_up.update(row['user_id'] for row in rows)
+        await asyncio.gather(*[prefetch(i * PREFETCH_STAGGER_SECONDS, row['user_id'], row['sheets_key'])
+                               for i, row in enumerate(rows)])
+        print(f'  Prefetched {len(rows)} sheets.')
+
+
+    def restore_snapshot(self, sheet, row):
+        if not isinstance(sheet, GoogleBackedSheet):
+            return False
+        try:
+            if not sheet.restore(row['state']):
+                return False
+        except Exception as e:
+            print(f'Failed restoring sheet {sheet.key} from its snapshot: {e}')
+            return False
+        sheet.revision = sheet.snapshot_revision = row['revision']
+        return True
+
+
+    async def save_snapshot(self, sheet):
+        try:
+            await self.db_manager.save_sheet_snapshot(sheet.key, sheet.revision, sheet.snapshot())
+            sheet.snapshot_revision = sheet.revision
+        except Exception as e:
+            print(f'Failed saving a snapshot of sheet {sheet.key}: {e}')
+
+
+    async def _prefetch(self, user_id, key):
+        if user_id in self.prefetching:
+            return
+        self.prefetching.add(user_id)
+        try:
+            sheet = self.sheets_cache.get(user_id)
+            if not sheet or sheet.key != key:
+                sheet = self.sheets_cache[user_id] = self.sheet_for_key(key)
+            await sheet.revalidate()
+        except Exception as e:
+            print(f'Failed to prefetch sheet {key}: {e}')
+        finally:
+            self.prefetching.discard(user_id)
+
+
+    async def _prefetch_current(self, user):
+        key = await self.db_manager.get_current(user)
+        if key:
+            await self._prefetch(user.id, key)
+
+
+    def note_activity(self, user, channel):
+        '''A player used a command in a channel. Refresh their sheet in the background, before they need it.'''
+        self.active_by_channel.setdefault(channel.id, set()).add(user.id)
+        sheet = self.sheets_cache.get(user.id)
+        if sheet and not sheet.is_fresh() and user.id not in self.prefetching and self._may_refresh(user.id):
+            asyncio.ensure_future(self._prefetch(user.id, sheet.key))
+        elif not sheet and user.id not in self.looked_up and self._may_refresh(user.id):
+            self.looked_up.add(user.id)
+            asyncio.ensure_future(self._prefetch_current(user))
+
+
+    def _may_refresh(self, user_id):
+        now = time.monotonic()
+        last = self.refreshed_at.get(user_id)
+        if last is not None and now - last < BACKGROUND_REFRESH_SECONDS:
+            return False
+        if not self.background_refreshes.try_acquire():
+            return False
+        self.refreshed_at[user_id] = now
+        return True
+
+
+    def get_loaded_sheet(self, user):
+        '''The user's sheet, if it's cached and has been pulled at least once. Never hits the network.'''
+        sheet = self.sheets_cache.get(user.id)
+        return sheet if sheet and sheet.loaded else None
+
+
     async def initiate_choose_profile(self, user, channel):
         key = self._generate_request_key(user, channel)
         if key in self.profile_selector_cache_by_request:
@@ -139,58 +438,106 @@ class SheetManager():
         await profile_selector.offer_profiles(profile_keys)
         
 
+    async def _party_sheet(self, user_id, key, semaphore):
+        '''A party member's sheet, from the cache if it's there, pulled (a few at a time) if it's stale.'''
+        sheet = self.sheets_cache.get(user_id)
+        if not sheet or sheet.key != key:
+            sheet = self.sheets_cache[user_id] = self.sheet_for_key(key)
+        if sheet.is_fresh():
+            return sheet
+        async with semaphore:
+            try:
+                await sheet.revalidate()
+            except SheetsError as e:
+                print(f'Failed to pull sheet {key} for the party: {e}')
+        return sheet if sheet.loaded else None
+
+
+    async def party(self, channel, skill=None):
+        '''!party - everyone in this campaign (channel), side by side. The campaign is whoever has rolled here,
+        or spoken here since the bot started, with a current profile.'''
+        if skill:
+            skill = await self.resolve_skill(channel, skill)
+            if not skill:
+                return
+
+        user_ids = set(await self.db_manager.roll_log.get_campaign_players(channel.id))
+        user_ids |= self.active_by_channel.get(channel.id, set())
+        rows = await self.db_manager.get_current_for(sorted(user_ids))
+        semaphore = asyncio.Semaphore(PREFETCH_CONCURRENCY)
+        sheets = await asyncio.gather(*[self._party_sheet(row['user_id'], row['sheets_key'], semaphore) for row in rows])
+        sheets = [sheet for sheet in sheets if sheet]
+        if not sheets:
+            return await channel.send('Nobody in this campaign has a profile selected.')
+
+        if skill:
+            column = SKILL_INDEX[skill]
+            ranked = sorted(sheets, key=lambda sheet: sheet.rating_vector()[column], reverse=True)
+            lines = [f'{sheet.name.title().ljust(21)}{str(sheet.rating_vector()[column] or "-").rjust(3)}' for sheet in ranked]
+            return await channel.send(f'**{skill.title()}** in this campaign:\n```' + '\n'.join(lines) + '```')
+
+        header = f"{'CHARACTER'.ljust(21)}{''.join([_.rjust(5) for _ in BASE_STAT_ABBREVIATIONS])}   BEST SKILLS"
+        lines = [header, '-' * len(header)]
+        for sheet in sorted(sheets, key=lambda sheet: sheet.name.lower()):
+            vector = sheet.rating_vector()
+            base = ''.join([str(vector[SKILL_INDEX[stat]] or '-').rjust(5) for stat in BASE_STATS])
+            best = sorted(range(len(BASE_STATS), len(PROGRESSIONS)), key=lambda i: vector[i], reverse=True)[:PARTY_TOP_SKILLS]
+            best = ', '.join([f'{PROGRESSIONS[i].title()} {vector[i]}' for i in best if vector[i]])
+            lines.append(f'{sheet.name.title().ljust(21)}{base}   {best}')
+        return await channel.send('The party:\n```' + '\n'.join(lines) + '```')
+
+
+    def check_valid_skill(self, skill):
+        return skill in SKILL_INDEX
+
+
     @with_profile
     async def display(self, user, channel, sheet=None):
-        # to_render = '\n'.join([await sheet._render_rating(skill) for skill in PROGRESSIONS if sheet.get_rating(skill)])
-        top_left_col = [f'{sheet.name}'.ljust(21), f'{sheet.rank}'.ljust(21), ''.ljust(21)]
-        desc = f'A {sheet.age} year old mouse from {sheet.home} with {sheet.fur} colored fur. '
-        desc += f'They wield a {sheet.weapon} and don a {sheet.cloak} cloak.'
-        top_right_col = textwrap.wrap(desc, 71)
-
-        rendered_ratings = [await sheet._render_rating(skill) for skill in PROGRESSIONS if sheet.skills[skill]['rating']]
-        skills_left = rendered_ratings[:len(rendered_ratings)//2]
-        skills_right = rendered_ratings[len(rendered_ratings)//2:]
-
-        if len(skills_left) < len(skills_right):
-            skills_left.append(skills_right.pop(0))
-            skills_right.append('')
-
-        skills_section = '\n'.join([f'{skills_left[i]}  {skills_right[i]}' for i in range(len(skills_left))])
-
-        box = {True: '▪', False: '▫'}
-        wises = [f"{wise['name'].ljust(33)}  {box[wise['pass']]}  {box[wise['fail']]}  " + 
-                    f"{box[wise['fate']]}  {box[wise['persona']]}" for wise in sheet.wises]
-        traits = [f"{trait['name'].ljust(21)}  Lv {trait['level']}        " + 
-                    f"{box[trait['uses'][0]]} {box[trait['uses'][1]]}" for trait in sheet.traits]
-        if len(wises) > len(traits):
-            traits += ['' for _ in range(len(wises) - len(traits))]
-        if len(traits) > len(wises):
-            wises += [' '*45 for _ in range(len(traits) - len(wises))]
-        wises_and_traits = '\n'.join([f'{wises[i]}   {traits[i]}' for i in range(len(wises))])
-        
-        msg = f'''```\
-{top_left_col[0]}{top_right_col[0]}
-{top_left_col[1]}{top_right_col[1]}
+        return await channel.send(f'{user.mention} - Your current profile:\n{sheet.render_card()}')
 
-SKILL                  SUCCESS     FAIL         SKILL                  SUCCESS     FAIL
----------------------------------------------------------------------------------------------
-{skills_section}
 
-WISE                               P  F  ⚀  !   TRAIT                  LEVEL       USES
----------------------------------------------------------------------------------------------
-{wises_and_traits}
-```'''
-        return await channel.send(f'{user.mention} - Your current profile:\n{msg}')
 
+    async def check_rating(self, user, channel, skill, progress=False, mark=None):
+        # Traits are named whatever the player likes. Anything else is a skill.
+        if mark != 'trait':
+            skill = await self.resolve_skill(channel, skill, user=user)
+            if not skill:
+                return
+        return await self._check_rating(user, channel, skill, progress=progress, mark=mark)
 
 
-class ProfileSelector():
+    @with_profile
+    async def _check_rating(self, user, channel, skill, progress=False, mark=None, sheet=None):
+        return await sheet.check_rating(skill, channel, user, progress=progress, mark=mark)
+
+
+    async def resolve_skill(self, channel, text, user=None):
+        '''The skill text stands for. If that's unclear, tells the player (with suggestions), and returns None.'''
+        skill, suggestions = SKILLS.resolve(text)
+        if not skill:
+            mention = f'{user.mention} - ' if user else ''
+            hint = f" Did you mean {', '.join([f'**{_.title()}**' for _ in suggestions])}?" if suggestions else ''
+            await channel.send(f'{mention}I don\'t know the skill **{text}**.{hint}')
+        return skill
+
+
+    def canonical_skill(self, text):
+        '''The skill text names, exactly (give or take case and spacing), or None.'''
+        return SKILLS.canonical(text) if text else None
+
+
+
+class ProfileSelector(Session):
+    __slots__ = ('manager', 'owner', 'channel', 'profile_choices', 'options', 'lock', 'message', 'view')
+
     def __init__(self, manager, owner, channel):
         self.manager = manager
         self.owner = owner
         self.channel = channel
         self.profile_choices = {}
+        self.options = set()
         self.lock = asyncio.Lock()
+        self.view = None
 
 
     async def initialize(self):
@@ -207,6 +554,11 @@ class ProfileSelector():
         
         choices = '\n'.join(['> ' + nums[i] + '  -  **' + names[i] + '** `' + profiles[i] + '`' for i in range(len(profiles))])
         msg = f'{self.owner.mention} - Select a profile\n\n{choices}'
+        self.options = set(self.profile_choices) | {'❌'}
+        if self.manager.use_buttons:
+            menu = [(nums[i], nums[i], names[i][:100], profiles[i][:100]) for i in range(len(profiles))]
+            return await self._edit(msg, SessionView(self, buttons=['❌'], choices=menu, placeholder='Choose a character'))
+
         await self.message.edit(content=msg)
         await self.message.clear_reactions()
         for emoji in nums[:len(profiles)]:
@@ -215,55 +567,119 @@ class ProfileSelector():
 
 
     async def cancel(self):
-        await self.message.edit(content=f'{self.owner.mention} - Profile select cancelled.')
-        await self.message.clear_reactions()
+        await self._close(f'{self.owner.mention} - Profile select cancelled.')
         await self.manager.uncache_profile_selector(self)
 
 
-    async def select(self, reaction=None):
+    async def expire(self):
+        await self._close(f'{self.owner.mention} - Profile select expired.')
+        await self.manager.uncache_profile_selector(self)
+
+
+    async def react(self, user_id, emoji, added=True):
+        if not added:
+            return
+        # If the reaction is from the owner, and a valid option, interpet it. Otherwise, purge.
+        if self.owner.id == user_id and emoji in self.options:
+            await self.select(emoji=emoji)
+        else:
+            await self.remove_reaction(emoji, user_id)
+
+
+    async def choose(self, interaction, value):
+        '''A pick from the select menu, or the cancel button.'''
+        if interaction.user.id != self.owner.id:
+            return await interaction.response.send_message('Those aren\'t your profiles!', ephemeral=True)
+        await interaction.response.defer()
+        if value in self.options:
+            await self.select(emoji=value)
+
+
+    async def select(self, emoji=None):
         # Lock prevents responses from interrupting previous runs while finishing
         # work, like loading emoji options for a particular question.
         async with self.lock:
             # Assess the response to the previous prompt.
             # Cancel button - close out the builder.
-            if reaction and reaction.emoji == '❌':
+            if emoji == '❌':
                 await self.cancel()
                 return
             else:
-                await self.message.edit(content=f'{self.owner.mention} - Using profile **{self.profile_choices[reaction.emoji][0]}**')
-                await self.manager.use_profile(self.owner, self.profile_choices[reaction.emoji][1])
-                await self.message.clear_reactions()
+                await self._close(f'{self.owner.mention} - Using profile **{self.profile_choices[emoji][0]}**')
+                await self.manager.use_profile(self.owner, self.profile_choices[emoji][1])
                 await self.manager.uncache_profile_selector(self)
 
 
     async def get_character_name_from_sheet(self, key):
-        gc = await self.manager.get_gc()
-        spreadsheet = await sync_to_async(gc.open_by_key)(key)
-        worksheet = await sync_to_async(spreadsheet.worksheet_by_title)('Character Sheet')
-        cell = await sync_to_async(worksheet.cell)(sheet_index['character']['name'])
-        name = cell.value.strip()
+        try:
+            name = (await self.manager.sheet_for_key(key).read_name()).strip()
+        except SheetsError as e:
+            print(f'Failed reading the name from sheet {key}: {e}')
+            name = ''
         return name.title() if name else 'Unnamed Character'
 
 
 
 
-class GoogleBackedSheet():
-    def __init__(self, manager, google_sheet_key):
+class CharacterSheet(ABC):
+    '''
+    A character sheet, cached. Where the sheet actually lives is up to the subclass - it fetches the grid
+    of cells, pushes batches of writes back, and reads the character's name for the profile selector.
+
+    Sheets stay cached for as long as the bot runs, so the parsed data is kept compact - skills are
+    Progress records in SKILL_INDEX order, wises and traits are tuples of records.'''
+    __slots__ = ('manager', 'key', 'loaded', 'pending_writes', 'flush_task', 'skills', 'skill_cells',
+                 'wises', 'traits', 'ratings', 'card', 'pulled_at', 'player', 'name', 'home', 'age', 'fur', 'rank', 'specialty', 'cloak', 'weapon')
+
+    def __init__(self, manager, key):
         self.manager = manager
-        self.google_sheet_key = google_sheet_key
+        self.key = key
+        self.loaded = False
+
+        # Writes not yet confirmed by the backend. cell --> value. Overlaid on every pull, so reads stay consistent.
+        self.pending_writes = {}
+        self.flush_task = None
+
+        # Both in SKILL_INDEX order. skill_cells holds the sheet index entry for skills present on the sheet.
+        self.skills = [EMPTY_PROGRESS] * len(PROGRESSIONS)
+        self.skill_cells = [None] * len(PROGRESSIONS)
+        self.wises = ()
+        self.traits = ()
+
+        # Rendered profile card, by section. pull() drops whichever sections it sees change.
+        self.card = {}
+        self.ratings = None
+        self.pulled_at = None
+
+
+    @abstractmethod
+    async def _fetch(self):
+        '''The sheet's grid, as rows of cell text. Not to be modified - it may be shared.'''
+        pass
+
+
+    @abstractmethod
+    async def _push(self, writes):
+        '''Writes cell --> value back to the sheet.'''
+        pass
 
 
-    async def access_sheet(self):
-        gc = await self.manager.get_gc()
-        spreadsheet = await sync_to_async(gc.open_by_key)(self.google_sheet_key)
-        worksheet = await sync_to_async(spreadsheet.worksheet_by_title)('Character Sheet')
-        return worksheet
+    @abstractmethod
+    async def read_name(self):
+        '''Just the character's name, as cheaply as possible.'''
+        pass
 
 
     async def pull(self):
-        '''Pulls all data from a sheet to local cache'''
-        sheet = await self.access_sheet()
-        data = await sync_to_async(sheet.get_all_values)()
+        '''Pulls all data from a sheet to local cache. Returns whether anything changed.'''
+        data = await self._fetch()
+        # Grids can be shared between pulls. Overlay writes on a copy.
+        if self.pending_writes:
+            data = [list(row) for row in data]
+        for cell, value in self.pending_writes.items():
+            self._set(data, cell, value)
+
+        top = self._top_fields() if self.loaded else None
 
         # do translations
         self.player = self._access(data, CHARACTER_INDEX['player'])
@@ -275,65 +691,102 @@ class GoogleBackedSheet():
         self.specialty = self._access(data, CHARACTER_INDEX['specialty'])
         self.cloak = self._access(data, CHARACTER_INDEX['cloak'])
         self.weapon = self._access(data, CHARACTER_INDEX['weapon'])
-        self.skills = {}
-        self.wises = []
-        self.traits = []
-
-        for base in BASE_STATS:
-            val = {
-                'rating': self._access_try_int(data, CHARACTER_INDEX[base]['rating']),
-                'success': self._access_try_int(data, CHARACTER_INDEX[base]['success']),
-                'fail': self._access_try_int(data, CHARACTER_INDEX[base]['fail'])
-            }
-            self.skills[base] = val
+        changed = self._top_fields() != top
+        if changed:
+            self._invalidate('top')
 
+        skills = [EMPTY_PROGRESS] * len(PROGRESSIONS)
+        skill_cells = [None] * len(PROGRESSIONS)
 
-        # Initialize bare skills, then populate from sheet
-        for skill in SKILL_LIST:
-            self.skills[skill] = { 'rating': None, 'success': 0, 'fail': 0 }
+        for base in BASE_STATS:
+            skills[SKILL_INDEX[base]] = self._access_progress(data, CHARACTER_INDEX[base])
+            skill_cells[SKILL_INDEX[base]] = CHARACTER_INDEX[base]
 
+        # Bare skills stay empty, then populate from sheet
         for skill in CHARACTER_INDEX['skills']:
-            name = self._access(data, skill['name']).lower()
-            # Missing skill in sheet, empty space
+            name = SKILLS.canonical(self._access(data, skill['name']))
+            # Missing skill in sheet (empty space), or a skill with a bad name. Big deal.
             if not name:
                 continue
-            # Skill with bad name in sheet, big deal
-            if name not in SKILL_LIST:
-                continue
-            val = {
-                'rating': self._access_try_int(data, skill['rating']),
-                'success': self._access_try_int(data, skill['success']),
-                'fail': self._access_try_int(data, skill['fail']),
-            }
-            self.skills[name] = val
-
-        self.wises = []
+            skills[SKILL_INDEX[name]] = self._access_progress(data, skill)
+            skill_cells[SKILL_INDEX[name]] = skill
+
+        wises = []
         for wise in CHARACTER_INDEX['wises']:
             name = self._access(data, wise['name']).lower()
             # empty
             if not name:
                 continue
-            val = {
-                'name': name,
-                'pass': self._access_try_bool(data, wise['pass']),
-                'fail': self._access_try_bool(data, wise['fail']),
-                'fate': self._access_try_bool(data, wise['fate']),
-                'persona': self._access_try_bool(data, wise['persona'])
-            }
-            self.wises.append(val)
+            wises.append(Wise(
+                name,
+                self._access_try_bool(data, wise['pass']),
+                self._access_try_bool(data, wise['fail']),
+                self._access_try_bool(data, wise['fate']),
+                self._access_try_bool(data, wise['persona'])))
         
-        self.traits = []
-        for trait in CHARACTER_INDEX['traits']:
+        traits = []
+        for slot, trait in enumerate(CHARACTER_INDEX['traits']):
             name = self._access(data, trait['name']).lower()
             # empty
             if not name:
                 continue
-            val = {
-                'name': name,
-                'level': self._access_try_int(data, trait['level']),
-                'uses': [self._access_try_bool(data, trait['uses'][0]), self._access_try_bool(data, trait['uses'][1])]
-            }
-            self.traits.append(val)
+            uses = (self._access_try_bool(data, trait['uses'][0]), self._access_try_bool(data, trait['uses'][1]))
+            traits.append(Trait(name, self._access_try_int(data, trait['level']), uses, slot))
+
+        if skills != self.skills:
+            changed = True
+            self._invalidate('skills')
+        if (tuple(wises), tuple(traits)) != (self.wises, self.traits):
+            changed = True
+            self._invalidate('wises_and_traits')
+        self.skills = skills
+        self.skill_cells = skill_cells
+        self.wises = tuple(wises)
+        self.traits = tuple(traits)
+        self.loaded = True
+        self.pulled_at = time.monotonic()
+        return changed
+
+
+    async def revalidate(self):
+        '''Make sure cached data is current. Backends that can tell cheaply whether a sheet changed, do.'''
+        await self.pull()
+
+
+    def snapshot(self):
+        '''The parsed sheet, serialized compactly - for SHEET_SNAPSHOTS, to skip pulling after a restart.'''
+        skill_slots = [-1 if cells is None or index < len(BASE_STATS) else CHARACTER_INDEX['skills'].index(cells)
+                       for index, cells in enumerate(self.skill_cells)]
+        state = [SNAPSHOT_VERSION, [self.player, self.name, self.home, self.age, self.fur, self.rank, self.specialty,
+                 self.cloak, self.weapon], self.skills, skill_slots, self.wises, self.traits]
+        return zlib.compress(json.dumps(state, separators=(',', ':')).encode())
+
+
+    def restore(self, snapshot):
+        '''Load a snapshot() in place of a pull. Returns False if it's from an older format.'''
+        state = json.loads(zlib.decompress(snapshot))
+        if state[0] != SNAPSHOT_VERSION:
+            return False
+        _, top, skills, skill_slots, wises, traits = state
+        (self.player, self.name, self.home, self.age, self.fur, self.rank, self.specialty, self.cloak, self.weapon) = top
+        self.skills = [Progress(*progress) for progress in skills]
+        self.skill_cells = [CHARACTER_INDEX[PROGRESSIONS[index]] if index < len(BASE_STATS) else
+                            CHARACTER_INDEX['skills'][slot] if slot >= 0 else None for index, slot in enumerate(skill_slots)]
+        self.wises = tuple(Wise(*wise) for wise in wises)
+        self.traits = tuple(Trait(name, level, tuple(uses), slot) for name, level, uses, slot in traits)
+        self.card = {}
+        self.ratings = None
+        self.loaded = True
+        self.pulled_at = time.monotonic()
+        return True
+
+
+    def is_fresh(self):
+        return self.pulled_at is not None and time.monotonic() - self.pulled_at < PULL_TTL_SECONDS
+
+
+    def _top_fields(self):
+        return (self.name, self.rank, self.age, self.home, self.fur, self.weapon, self.cloak)
 
 
     def get_success(self, key):
@@ -349,19 +802,36 @@ class GoogleBackedSheet():
 
 
     def check_valid_skill(self, skill):
-        return skill in PROGRESSIONS
+        return skill in SKILL_INDEX
 
 
     def _get_skill_subvalue(self, key, subvalue):
-        return self.skills[key][subvalue] if key in self.skills else None
+        index = SKILL_INDEX.get(key)
+        return getattr(self.skills[index], subvalue) if index is not None else None
+
+
+    def _access_progress(self, data, cells):
+        return Progress(self._access_try_int(data, cells['rating']), self._access_try_int(data, cells['success']),
+                        self._access_try_int(data, cells['fail']))
 
 
     def _access(self, data, cell):
         col = ord(cell[0]) - ord('A')
         row = int(cell[1:]) - 1
+        # The API leaves off trailing empty rows and cells
+        if row >= len(data) or col >= len(data[row]):
+            return ''
         return data[row][col]
 
 
+    def _set(self, data, cell, value):
+        col = ord(cell[0]) - ord('A')
+        row = int(cell[1:]) - 1
+        data.extend([] for _ in range(row + 1 - len(data)))
+        data[row].extend('' for _ in range(col + 1 - len(data[row])))
+        data[row][col] = 'TRUE' if value is True else 'FALSE' if value is False else str(value)
+
+
     def _access_try_int(self, data, cell):
         # Convert to an int if possible. If not, return as-is
         val = self._access(data, cell)
@@ -377,24 +847,291 @@ class GoogleBackedSheet():
         return 'TRUE' == self._access(data, cell)
 
 
-    async def _render_rating(self, skill):
-        if skill not in self.skills or not self.skills[skill]['rating']:
+    def _render_rating(self, skill):
+        index = SKILL_INDEX.get(skill)
+        if index is None:
             return
-        
-        values = self.skills[skill]
-        use_luck = self.get_rating(skill) == 'x' or self.get_rating(skill) == '0'
-
-        success_fill = min(self.get_success(skill), 9)
-        success_empty = self.get_rating(skill) - self.get_success(skill) if not use_luck else 6 - self.get_success(skill)
-        success_empty = min(success_empty, 9 - success_fill)
-
-        fail_fill = self.get_fail(skill) if not use_luck else 0
-        fail_fill = min(fail_fill, 8)
-        fail_empty = self.get_rating(skill) - self.get_fail(skill) - 1 if not use_luck else 0
-        fail_empty = min(fail_empty, 8 - fail_fill)
-
-        skill_portion = f"{(skill.title() + ':').ljust(17)}{(str(self.get_rating(skill)) if not use_luck else '*').rjust(2)}    "
-        success_portion = f"{'▪'*success_fill + '▫'*success_empty}"
-        fail_portion = f"{'▪'*fail_fill + '▫'*fail_empty}"
-        progress_portion = f"{success_portion.ljust(9)}   {fail_portion.ljust(8)}   "
-        return f"{skill_portion}{progress_portion}"
+        return render_rating(skill, *self.skills[index])
+
+
+    def _invalidate(self, *sections):
+        for section in sections:
+            self.card.pop(section, None)
+        self.card.pop('card', None)
+        if 'skills' in sections:
+            self.ratings = None
+
+
+    def rating_vector(self):
+        '''Every rating, as a number (0 if there's none, or it's on luck), in SKILL_INDEX order. Kept until the
+        skills change, so ranking a party by any skill is just indexing.'''
+        if self.ratings is None:
+            self.ratings = tuple([progress.rating if isinstance(progress.rating, int) else 0 for progress in self.skills])
+        return self.ratings
+
+
+    def render_card(self):
+        '''The profile card for !profile display. Each section is rendered once, and kept until pull() or a
+        write changes what's in it.'''
+        if 'card' in self.card:
+            return self.card['card']
+
+        if 'top' not in self.card:
+            top_left_col = [f'{self.name}'.ljust(21), f'{self.rank}'.ljust(21), ''.ljust(21)]
+            desc = f'A {self.age} year old mouse from {self.home} with {self.fur} colored fur. '
+            desc += f'They wield a {self.weapon} and don a {self.cloak} cloak.'
+            top_right_col = textwrap.wrap(desc, 71)
+            self.card['top'] = f'{top_left_col[0]}{top_right_col[0]}\n{top_left_col[1]}{top_right_col[1]}'
+
+        if 'skills' not in self.card:
+            rendered_ratings = [self._render_rating(skill) for skill in PROGRESSIONS if self.get_rating(skill)]
+            skills_left = rendered_ratings[:len(rendered_ratings)//2]
+            skills_right = rendered_ratings[len(rendered_ratings)//2:]
+
+            if len(skills_left) < len(skills_right):
+                skills_left.append(skills_right.pop(0))
+                skills_right.append('')
+
+            self.card['skills'] = '\n'.join([f'{skills_left[i]}  {skills_right[i]}' for i in range(len(skills_left))])
+
+        if 'wises_and_traits' not in self.card:
+            box = {True: '▪', False: '▫'}
+            wises = [f"{wise.name.ljust(33)}  {box[wise.passed]}  {box[wise.failed]}  " + 
+                        f"{box[wise.fate]}  {box[wise.persona]}" for wise in self.wises]
+            traits = [f"{trait.name.ljust(21)}  Lv {trait.level}        " + 
+                        f"{box[trait.uses[0]]} {box[trait.uses[1]]}" for trait in self.traits]
+            if len(wises) > len(traits):
+                traits += ['' for _ in range(len(wises) - len(traits))]
+            if len(traits) > len(wises):
+                wises += [' '*45 for _ in range(len(traits) - len(wises))]
+            self.card['wises_and_traits'] = '\n'.join([f'{wises[i]}   {traits[i]}' for i in range(len(wises))])
+
+        self.card['card'] = f'''```\
+{self.card['top']}
+
+SKILL                  SUCCESS     FAIL         SKILL                  SUCCESS     FAIL
+---------------------------------------------------------------------------------------------
+{self.card['skills']}
+
+WISE                               P  F  ⚀  !   TRAIT                  LEVEL       USES
+---------------------------------------------------------------------------------------------
+{self.card['wises_and_traits']}
+```'''
+        return self.card['card']
+
+
+    def queue_write(self, cell, value):
+        '''Queue a cell write. Writes are merged by cell, and flushed in one batch once things go quiet.'''
+        self.pending_writes[cell] = value
+        if not self.flush_task:
+            self.flush_task = asyncio.ensure_future(self._flush_later())
+
+
+    async def _flush_later(self):
+        await asyncio.sleep(WRITE_DEBOUNCE_SECONDS)
+        self.flush_task = None
+        await self.flush()
+
+
+    async def flush(self):
+        '''Push all pending writes in a single batch. If the backend is only in temporary trouble (google
+        rate limiting, say), the writes stay pending, and go out with the next batch.'''
+        if not self.pending_writes:
+            return
+
+        writes = dict(self.pending_writes)
+        try:
+            await self._push(writes)
+        except SheetsError as e:
+            if e.transient:
+                print(f'Failed writing to sheet {self.key}, will try again: {e}')
+                if not self.flush_task:
+                    self.flush_task = asyncio.ensure_future(self._flush_later())
+                return
+            print(f'Giving up on {len(writes)} writes to sheet {self.key}: {e}')
+
+        # Anything re-queued while we were writing stays pending for the next batch
+        for cell, value in writes.items():
+            if self.pending_writes.get(cell) == value:
+                del self.pending_writes[cell]
+
+
+    def can_mark_test(self, skill):
+        '''Whether the skill is on the sheet, with pass and fail boxes to tick.'''
+        index = SKILL_INDEX.get(skill)
+        return index is not None and bool(self.skill_cells[index])
+
+
+    def mark_test(self, skill, passed):
+        '''Tick a pass or fail towards advancing a skill. Returns False if the skill isn't on the sheet.'''
+        if not self.can_mark_test(skill):
+            return False
+        index = SKILL_INDEX[skill]
+        subvalue = 'success' if passed else 'fail'
+        current = getattr(self.skills[index], subvalue)
+        value = (current if isinstance(current, int) else 0) + 1
+        self.skills[index] = self.skills[index]._replace(**{subvalue: value})
+        self._invalidate('skills')
+        self.queue_write(self.skill_cells[index][subvalue], value)
+        return True
+
+
+    def tax_nature(self, amount=1):
+        rating = self.get_rating('nature')
+        if not isinstance(rating, int) or amount < 1:
+            return False
+        index = SKILL_INDEX['nature']
+        self.skills[index] = self.skills[index]._replace(rating=max(rating - amount, 0))
+        self._invalidate('skills')
+        self.queue_write(CHARACTER_INDEX['nature']['rating'], self.skills[index].rating)
+        return True
+
+
+    def mark_trait_use(self, name):
+        '''Check off the next free use box on a trait. Returns False if there isn't one.'''
+        for position, trait in enumerate(self.traits):
+            if trait.name != name:
+                continue
+            for i, used in enumerate(trait.uses):
+                if not used:
+                    uses = trait.uses[:i] + (True,) + trait.uses[i + 1:]
+                    self.traits = self.traits[:position] + (trait._replace(uses=uses),) + self.traits[position + 1:]
+                    self._invalidate('wises_and_traits')
+                    self.queue_write(CHARACTER_INDEX['traits'][trait.slot]['uses'][i], True)
+                    return True
+        return False
+
+
+    async def check_rating(self, skill, channel, user, progress=False, mark=None):
+        if mark == 'trait':
+            marked = self.mark_trait_use(skill)
+            msg = f'Checked off a use of **{skill.title()}**.' if marked else f'No unused **{skill.title()}** trait on your sheet.'
+            return await channel.send(f'{user.mention} - {msg}')
+
+        if not self.check_valid_skill(skill):
+            return await channel.send(f'{user.mention} - I don\'t know the skill **{skill}**.')
+
+        if progress and mark in ('pass', 'fail'):
+            if not self.mark_test(skill, mark == 'pass'):
+                return await channel.send(f'{user.mention} - **{skill.title()}** isn\'t on your sheet yet. Add it, then try again.')
+        elif progress and mark == 'tax':
+            if skill != 'nature' or not self.tax_nature(1):
+                return await channel.send(f'{user.mention} - Only nature can be taxed.')
+
+        rendered = self._render_rating(skill)
+        if not rendered:
+            return await channel.send(f'{user.mention} - You have no rating in **{skill.title()}**.')
+        return await channel.send(f'{user.mention}\n```{rendered}```')
+
+
+
+class GoogleBackedSheet(CharacterSheet):
+    '''
+    A character sheet on google. A pull is one values.get for the whole tab, once its title is known.
+
+    Parsed sheets are snapshotted to the database, along with the sheet's revision (its modifiedTime on
+    drive). After a restart, a sheet comes back from its snapshot, and is only pulled again if the
+    revision has moved on. The revision held only moves on once a pull has succeeded, so it's never newer
+    than the data. A pull that fails leaves it where it was, and the next revalidate tries again.'''
+    __slots__ = ('revision', 'snapshot_revision')
+
+    def __init__(self, manager, key):
+        super().__init__(manager, key)
+        self.revision = None
+        self.snapshot_revision = None
+
+
+    async def pull(self, revision=None):
+        '''revision is the one looked up just before, if any. It's only taken once the pull has worked.'''
+        changed = await super().pull()
+        if revision is not None:
+            self.revision = revision
+        if changed or self.revision != self.snapshot_revision:
+            await self.manager.save_snapshot(self)
+        return changed
+
+
+    async def revalidate(self):
+        '''A drive metadata lookup, and a pull only if the sheet has changed since the revision held.'''
+        revision = await self.manager.client.get_modified_time(self.key)
+        if revision == self.revision and self.loaded:
+            self.pulled_at = time.monotonic()
+            return
+        await self.pull(revision)
+
+
+    async def _fetch(self):
+        client = self.manager.client
+        return await self.manager.on_tab(self.key, lambda tab: client.get_values(self.key, a1_range(tab)))
+
+
+    async def _push(self, writes):
+        client = self.manager.client
+        await self.manager.on_tab(self.key, lambda tab: client.batch_update_values(
+            self.key, {a1_range(tab, cell): value for cell, value in writes.items()}))
+
+
+    async def read_name(self):
+        client = self.manager.client
+        rows = await self.manager.on_tab(self.key, lambda tab: client.get_values(self.key, a1_range(tab, CHARACTER_INDEX['name'])))
+        return rows[0][0] if rows and rows[0] else ''
+
+
+
+class LocalSheet(CharacterSheet):
+    '''
+    A character sheet in a local file (see localsheets.py), somewhere under the configured local_sheets_dir.
+
+    The file is parsed once, and the grid kept until the file's mtime changes. So a sheet is fresh for as
+    long as nobody touches the file, and checking costs a stat. Writes go straight back into the file,
+    except for .ods files - there, they're kept in the cached grid until the file changes.'''
+    __slots__ = ('path', 'mtime', 'grid')
+
+    def __init__(self, manager, key):
+        super().__init__(manager, key)
+        self.path = resolve_path(manager.local_sheets_dir, key)
+        self.mtime = None
+        self.grid = None
+
+
+    def _stat(self):
+        try:
+            return os.stat(self.path).st_mtime_ns if self.path else None
+        except OSError:
+            return None
+
+
+    def is_fresh(self):
+        return self.loaded and self.mtime is not None and self._stat() == self.mtime
+
+
+    async def _fetch(self):
+        mtime = self._stat()
+        if mtime is None:
+            raise LocalSheetError(f'No sheet file at {self.key}')
+        if mtime != self.mtime:
+            try:
+                self.grid = load_grid(self.path)
+            except (OSError, ValueError) as e:
+                raise LocalSheetError(f'Couldn\'t read {self.key}: {e}')
+            self.mtime = mtime
+        return self.grid
+
+
+    async def _push(self, writes):
+        for cell, value in writes.items():
+            self._set(self.grid, cell, value)
+        try:
+            if write_cells(self.path, writes):
+                self.mtime = self._stat()
+        except (OSError, ValueError) as e:
+            raise LocalSheetError(f'Couldn\'t write {self.key}: {e}')
+
+
+    async def revalidate(self):
+        if not self.is_fresh():
+            await self.pull()
+
+
+    async def read_name(self):
+        return self._access(await self._fetch(), CHARACTER_INDEX['name'])
@@ -0,0 +1,124 @@
+import re
+
+
+def normalize(text):
+    '''Lowercase letters only. "Weather-Watcher", "weather watcher" and "weatherwatcher" all come out the same.'''
+    return re.sub(r'[^a-z]', '', text.lower())
+
+
+def distance(a, b):
+    '''Edit distance, where swapping two neighbouring letters counts as one edit (optimal string alignment).'''
+    previous, current = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        before, previous, current = previous, current, [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], before[j - 2] + 1)
+    return current[len(b)]
+
+
+
+class BKTree():
+    '''Words arranged by edit distance, so finding everything within a few edits of a word skips most of them.'''
+    def __init__(self, words):
+        self.root = None
+        for word in words:
+            self.add(word)
+
+
+    def add(self, word):
+        if self.root is None:
+            self.root = (word, {})
+            return
+        node = self.root
+        while True:
+            d = distance(word, node[0])
+            if d not in node[1]:
+                node[1][d] = (word, {})
+                return
+            node = node[1][d]
+
+
+    def search(self, word, tolerance):
+        '''(distance, word) for every word within tolerance edits, closest first.'''
+        found = []
+        nodes = [self.root] if self.root else []
+        while nodes:
+            node_word, children = nodes.pop()
+            d = distance(word, node_word)
+            if d <= tolerance:
+                found.append((d, node_word))
+            nodes += [child for edge, child in children.items() if d - tolerance <= edge <= d + tolerance]
+        return sorted(found)
+
+
+
+class SkillLookup():
+    '''
+    Turns whatever a player typed into a skill name, all worked out up front.
+
+    Exact names are a set lookup, and so is anything that normalizes to a name ("weatherwatcher"). Failing
+    that, an unambiguous prefix ("scou") wins, then an unambiguous closest typo ("sctou"). Anything still
+    unclear comes back with suggestions instead.'''
+    SUGGESTIONS = 5
+
+    def __init__(self, names):
+        self.names = frozenset(names)
+        self.by_normalized = {normalize(name): name for name in names}
+
+        # Prefix trie, on normalized names. Each node keeps every name underneath it.
+        self.trie = {'names': sorted(self.by_normalized.values())}
+        for key, name in sorted(self.by_normalized.items()):
+            node = self.trie
+            for letter in key:
+                node = node.setdefault(letter, {'names': []})
+                node['names'].append(name)
+
+        self.typos = BKTree(self.by_normalized)
+
+
+    def canonical(self, text):
+        '''The exact name text stands for, or None. No guessing - this is for reading sheets.'''
+        if text in self.names:
+            return text
+        return self.by_normalized.get(normalize(text))
+
+
+    def complete(self, text, limit):
+        '''Up to limit names starting with text (give or take case and spacing), for autocompletion.'''
+        node = self.trie
+        for letter in normalize(text or ''):
+            node = node.get(letter)
+            if node is None:
+                return []
+        return node['names'][:limit]
+
+
+    def resolve(self, text):
+        '''(name, suggestions). name is None if text is unclear, and suggestions may help the player out.'''
+        name = self.canonical(text)
+        if name:
+            return name, []
+        key = normalize(text)
+        if not key:
+            return None, []
+
+        node = self.trie
+        for letter in key:
+            node = node.get(letter)
+            if node is None:
+                break
+        if node is not None:
+            if len(node['names']) == 1:
+                return node['names'][0], []
+            return None, node['names'][:self.SUGGESTIONS]
+
+        # A typo. Short words get less leeway, or everything would be a match.
+        tolerance = 1 if len(key) <= 4 else 2
+        matches = self.typos.search(key, tolerance)
+        if matches and (len(matches) == 1 or matches[0][0] < matches[1][0]):
+            return self.by_normalized[matches[0][1]], []
+        suggestions = matches or self.typos.search(key, tolerance + 1)
+        return None, [self.by_normalized[word] for _, word in suggestions[:self.SUGGESTIONS]]
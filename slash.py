@@ -0,0 +1,152 @@
+import asyncio
+from typing import Literal
+
+from discord import app_commands
+
+from rolling import MAXIMUM_NUMBER_OF_DICE
+from sheets import SKILLS
+from util import get_sheets_key
+
+
+# Discord wants an answer to an interaction within 3 seconds. Anything slower (a sheet pull, say) gets a
+# "thinking..." placeholder after this long, and fills it in when it's done.
+RESPOND_WITHIN_SECONDS = 2
+
+# Most autocomplete choices discord will show
+AUTOCOMPLETE_LIMIT = 25
+
+
+class InteractionChannel():
+    '''
+    Stands in for the channel a slash command was used in, so the same RollerManager and SheetManager
+    methods that answer prefix commands can answer slash commands.
+
+    The first message sent is the interaction's response - no separate message, and no placeholder to edit
+    later. Anything after that goes to the channel as usual. Messages are handed back as plain channel
+    messages, so sessions can keep editing them after the interaction's token (15 minutes) runs out.'''
+    def __init__(self, interaction):
+        self.interaction = interaction
+        self.channel = interaction.channel
+        self.id = interaction.channel_id
+        self.guild = interaction.guild
+        self.answered = False
+        self.lock = asyncio.Lock()
+        self.deferral = asyncio.ensure_future(self._defer_later())
+
+
+    async def _defer_later(self):
+        await asyncio.sleep(RESPOND_WITHIN_SECONDS)
+        async with self.lock:
+            if not self.interaction.response.is_done():
+                await self.interaction.response.defer(thinking=True)
+
+
+    async def send(self, content=None, **kwargs):
+        async with self.lock:
+            self.deferral.cancel()
+            if self.answered:
+                return await self.channel.send(content, **kwargs)
+            self.answered = True
+            if self.interaction.response.is_done():
+                # Deferred. This replaces the "thinking..." placeholder.
+                message_id = (await self.interaction.followup.send(content, wait=True, **kwargs)).id
+            else:
+                message_id = (await self.interaction.response.send_message(content, **kwargs)).message_id
+        return self.channel.get_partial_message(message_id)
+
+
+    async def close(self):
+        '''Every interaction needs an answer. If the command didn't give one, just acknowledge it.'''
+        self.deferral.cancel()
+        if not self.answered:
+            await self.send('✅')
+
+
+
+class CommandTree(app_commands.CommandTree):
+    '''Turns commands away while the bot is shutting down, and counts the rest as in flight until they're done.'''
+    async def interaction_check(self, interaction):
+        lifecycle = self.client.lifecycle
+        if lifecycle.stopping:
+            await interaction.response.send_message('I\'m restarting. Try again in a moment!', ephemeral=True)
+            return False
+        lifecycle.track()
+        return True
+
+
+    async def on_error(self, interaction, error):
+        # Already answered, in interaction_check
+        if isinstance(error, app_commands.CheckFailure):
+            return
+        await super().on_error(interaction, error)
+
+
+
+async def _skill_choices(interaction, current):
+    return [app_commands.Choice(name=name.title(), value=name) for name in SKILLS.complete(current, AUTOCOMPLETE_LIMIT)]
+
+
+def add_commands(client, tree, use_sheets=False):
+    '''
+    Slash commands, alongside the prefix commands. Discord parses the arguments, so there's no regex
+    matching, and they go straight to the same manager methods.'''
+    def answer(interaction):
+        channel = InteractionChannel(interaction)
+        # Whoever's using commands is likely to roll soon. Get their sheet ready.
+        if use_sheets:
+            client.sheets.note_activity(interaction.user, channel)
+        return channel
+
+    @tree.command(name='roll', description='Roll dice, or start a roll builder (leave dice out).')
+    @app_commands.rename(reason='for')
+    @app_commands.describe(dice='How many dice', obstacle='The obstacle to beat', reason='What the roll is for - a skill, for the roll builder')
+    @app_commands.autocomplete(reason=_skill_choices)
+    async def roll(interaction, dice: app_commands.Range[int, 1, MAXIMUM_NUMBER_OF_DICE] = None,
+                   obstacle: app_commands.Range[int, 1, 9] = None, reason: str = None):
+        channel = answer(interaction)
+        if dice is None:
+            # A known skill (or a close enough guess at one) gets its proper name. Anything else is just a label.
+            skill = reason.strip().lower() if reason else None
+            skill = SKILLS.resolve(skill)[0] or skill if skill else None
+            await client.roller.create(interaction.user, channel, skill=skill)
+        elif obstacle is None and reason is None and await client.roller.submit_versus(interaction.user, channel, dice):
+            await channel.send(f'{interaction.user.mention} submitted **{dice}** dice to the versus test.')
+        else:
+            await client.roller.create(interaction.user, channel, num_dice=dice, obstacle=obstacle, reason=reason)
+        await channel.close()
+
+    @tree.command(name='status', description='Startup and reconnect timings, and how the bot is doing.')
+    async def status(interaction):
+        channel = answer(interaction)
+        await client.status(channel)
+        await channel.close()
+
+    if not use_sheets:
+        return
+
+    @tree.command(name='profile', description='Manage and select your character sheets.')
+    @app_commands.describe(action='What to do', sheet='The sheet url (or key, or local path) to register or unregister')
+    async def profile(interaction, action: Literal['select', 'display', 'register', 'unregister'], sheet: str = None):
+        channel = answer(interaction)
+        key = get_sheets_key(sheet.strip()) if sheet else None
+        if action in ('register', 'unregister') and not key:
+            await channel.send(f'{interaction.user.mention} - Which sheet? Give its url, or path.')
+        elif action == 'register':
+            await client.sheets.register_profile(channel, interaction.user, key)
+        elif action == 'unregister':
+            await client.sheets.unregister_profile(channel, interaction.user, key)
+        elif action == 'select':
+            await client.sheets.initiate_choose_profile(interaction.user, channel)
+        elif action == 'display':
+            await client.sheets.display(interaction.user, channel)
+        await channel.close()
+
+    @tree.command(name='rating', description='Check a skill on your sheet, or mark progress towards it.')
+    @app_commands.describe(skill='The skill (or, to mark a trait, the trait)', progress='Show pass/fail progress',
+                           mark='Mark a pass, fail, nature tax, or trait use')
+    @app_commands.autocomplete(skill=_skill_choices)
+    async def rating(interaction, skill: str, progress: bool = False, mark: Literal['pass', 'fail', 'tax', 'trait'] = None):
+        channel = answer(interaction)
+        # Marks only count as progress
+        await client.sheets.check_rating(interaction.user, channel, skill.strip().lower(), progress=progress or bool(mark), mark=mark)
+        await channel.close()
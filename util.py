@@ -1,5 +1,7 @@
 import re
 
+import discord
+
 
 class ValueRetainingRegexMatcher:
     '''This is a load of BS to just get around not using PEP 572'''
@@ -61,3 +63,73 @@ def render_dice_pool(pool, with_history=False):
 {explosion_diff_to_emoji_str(changes, operation)}
 {dice_result_to_emoji_str(result)}    ➡️    `{breakdown_portion}{value}!`'''
     return msg
+
+
+class ReactionTally():
+    '''Per-session record of who has reacted with what, built from raw gateway events.
+
+    discord.py only hydrates reaction counts for messages in its message cache, which a busy server
+    churns through quickly. Sessions keep their own tally instead, updated one event at a time.'''
+    __slots__ = ('users_by_emoji',)
+
+    def __init__(self):
+        self.users_by_emoji = {}
+
+
+    def update(self, emoji, user_id, added=True):
+        users = self.users_by_emoji.setdefault(emoji, set())
+        if added:
+            users.add(user_id)
+        else:
+            users.discard(user_id)
+
+
+    def count(self, emoji, exclude=()):
+        users = self.users_by_emoji.get(emoji, ())
+        return len([_ for _ in users if _ not in exclude])
+
+
+    def toggle(self, emoji, user_id):
+        '''Flips whether user_id is counted for emoji, and returns whether they now are.'''
+        added = user_id not in self.users_by_emoji.get(emoji, ())
+        self.update(emoji, user_id, added)
+        return added
+
+
+    def clear(self):
+        self.users_by_emoji = {}
+
+
+
+class SessionView(discord.ui.View):
+    '''
+    A session's options as message components (buttons, and optionally a select menu), instead of reactions.
+
+    The prompt and every option go out together in a single message edit, and clicks come back as
+    interactions, rather than reaction events that need cleaning up after. Each click is handed to
+    session.choose(interaction, value), which is responsible for responding to the interaction. value is
+    the button's emoji, or the picked select option's value.'''
+    def __init__(self, session, buttons=(), choices=(), placeholder=None):
+        # Sessions expire on their own terms
+        super().__init__(timeout=None)
+        self.session = session
+        if choices:
+            select = discord.ui.Select(placeholder=placeholder, options=[
+                discord.SelectOption(label=label, value=value, emoji=emoji, description=description)
+                for value, emoji, label, description in choices])
+            select.callback = lambda interaction: session.choose(interaction, select.values[0])
+            self.add_item(select)
+        # emoji --> button, so a session can relabel one (with a count, say)
+        self.buttons = {}
+        for emoji in buttons:
+            style = discord.ButtonStyle.danger if emoji == '❌' else discord.ButtonStyle.secondary
+            button = discord.ui.Button(emoji=emoji, style=style)
+            button.callback = self._chooser(emoji)
+            self.buttons[emoji] = button
+            self.add_item(button)
+
+
+    def _chooser(self, value):
+        async def choose(interaction):
+            await self.session.choose(interaction, value)
+        return choose
@@ -0,0 +1,94 @@
+import asyncio
+
+import discord
+
+from util import render_dice_pool
+
+
+# Open versus tests that nobody finishes get closed out after this long
+VERSUS_TIMEOUT_SECONDS = 15 * 60
+
+
+class VersusTest():
+    '''
+    A versus (or group) test - several players' pools, rolled and compared in one shared message.
+
+    Every participant submits their pool on their own time, with a plain `!roll <dice>`, or by finishing a
+    roll builder (for when there's help, gear, and wises to count). Submissions don't wait on each other, or
+    on any lock; each one just fills in that player's slot. Once the last slot is filled, every pool that
+    isn't rolled yet is rolled, and the result goes out as a single edit of the shared message. No matter
+    how big the table, that's one message, and two API calls to it.'''
+    def __init__(self, manager, owner, channel, participants, reason=None):
+        self.manager = manager
+        self.owner = owner
+        self.channel = channel
+        self.participants = participants
+        self.reason = reason
+        self.pools = {}
+        # Participants whose pools came in already rolled. The roll builder logged those itself.
+        self.prerolled = set()
+        self.resolved = False
+        self.timeout = None
+
+
+    async def initialize(self):
+        names = ', '.join([_.mention for _ in self.participants])
+        reason_portion = f' **for {self.reason}**' if self.reason else ''
+        self.message = await self.channel.send(
+            f'⚔️ Versus test{reason_portion} between {names}!\n>>> Each of you, submit your dice with `!roll <dice>`, or build them with `!roll`.')
+        self.timeout = asyncio.ensure_future(self._expire_later())
+
+
+    def is_waiting_on(self, user):
+        return not self.resolved and user.id not in self.pools
+
+
+    async def submit(self, user, pool):
+        '''Fill in a participant's pool. Whoever fills the last one resolves the whole test.'''
+        self.pools[user.id] = pool
+        if pool.result_history:
+            self.prerolled.add(user.id)
+        if len(self.pools) < len(self.participants) or self.resolved:
+            return
+        self.resolved = True
+        await self.resolve()
+
+
+    async def resolve(self):
+        for user_id, pool in self.pools.items():
+            if user_id not in self.prerolled:
+                pool.roll()
+        if self.timeout:
+            self.timeout.cancel()
+        self.manager.end_versus(self)
+
+        best = max([pool.value() for pool in self.pools.values()])
+        winners = [_ for _ in self.participants if self.pools[_.id].value() == best]
+
+        lines = []
+        for participant in sorted(self.participants, key=lambda _: self.pools[_.id].value(), reverse=True):
+            pool = self.pools[participant.id]
+            medal = '  🏆' if participant in winners and len(winners) == 1 else ''
+            lines.append(f'{participant.mention} ({pool.size()}):  {render_dice_pool(pool)}{medal}')
+            if participant.id not in self.prerolled:
+                self.manager.log_pool(participant, self.channel, pool)
+
+        outcome = f'{winners[0].mention} wins!' if len(winners) == 1 else f"It's a tie between {', '.join([_.mention for _ in winners])}!"
+        reason_portion = f' **for {self.reason}**' if self.reason else ''
+        msg = f'⚔️ Versus test{reason_portion}! {outcome}\n>>> ' + '\n'.join(lines)
+        await self.message.edit(content=msg, allowed_mentions=discord.AllowedMentions.none())
+
+
+    async def cancel(self, reason='cancelled'):
+        self.resolved = True
+        if self.timeout:
+            self.timeout.cancel()
+        self.manager.end_versus(self)
+        await self.message.edit(content=f'⚔️ Versus test {reason}.')
+
+
+    async def _expire_later(self):
+        await asyncio.sleep(VERSUS_TIMEOUT_SECONDS)
+        self.timeout = None
+        if not self.resolved:
+            await self.cancel(reason='expired')